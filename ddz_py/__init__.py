@@ -3,6 +3,15 @@ __all__ = [
         'server',
         'client',
         'protocol',
+        'command',
+        'tournament',
+        'ratelimit',
+        'stats',
+        'timer',
         'client_vanilla',
         'client_deluxe',
+        'client_script',
+        'render',
+        'bench',
+        'odds',
         ]
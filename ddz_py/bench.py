@@ -0,0 +1,213 @@
+import argparse
+import json
+import random
+import sys
+import time
+import timeit
+import zlib
+
+from .card import suit_cards, card_rank, is_bomb
+from .data import DdzPlayer
+from .protocol import encode_frame, encode_msg
+from .ratelimit import TokenBucket
+from .server import Player, rating_deltas
+
+
+# hands of `/start' peasants and landlord, `/start4', and the biggest hand
+# `/start_any' can deal, `/start_any 1 539 10'
+HAND_SIZES = [17, 20, 25, 539]
+
+DEFAULT_BASELINE = 'bench_baseline.json'
+
+
+def make_hand(size: int, rng: random.Random) -> list[str]:
+    suit = size // len(suit_cards) + 1
+    hand = rng.sample(suit_cards * suit, size)
+    hand.sort(key = lambda x: card_rank[x])
+    return hand
+
+
+def sync_cards_msg(hand: list[str]) -> str:
+    return json.dumps({
+            'type': 'sync',
+            'attr': [{'key': 'cards', 'val': hand}]})
+
+
+def compression_frames(kind: str, count: int, rng: random.Random) -> list[bytes]:
+    if kind.startswith('sync'):
+        size = int(kind[len('sync'):])
+        hand = make_hand(size, rng)
+        frames = []
+        for i in range(count):
+            # the hand shrinks as the game goes on
+            if len(hand) > 1:
+                del hand[rng.randrange(len(hand))]
+            frames.append(sync_cards_msg(hand).encode())
+        return frames
+    if kind == 'list':
+        names = [f'player{i:03}' for i in range(300)]
+        abbr = ['S', 'AS', 'L', 'P1', 'P2']
+        return ['\n'.join(f'{n} [{rng.choice(abbr)}]' for n in names).encode() for i in range(count)]
+    if kind == 'chat':
+        words = 'the landlord has a bomb again and we peasants are doomed lol gg'.split()
+        return [json.dumps({
+                'type': 'chat',
+                'author': f'player{rng.randrange(300):03}',
+                'player_type': 'spectator',
+                'content': ' '.join(rng.choices(words, k = rng.randrange(3, 15)))}).encode()
+                for i in range(count)]
+    raise Exception(f'unknown frame kind: {kind}')
+
+
+def micro_benchmarks(seed: int) -> dict:
+    rng = random.Random(seed)
+    benches = {}
+
+    benches['is_bomb/bomb'] = lambda: is_bomb(['7', '7', '7', '7'])
+    benches['is_bomb/rocket'] = lambda: is_bomb(['Y', 'Z'])
+    benches['is_bomb/straight'] = lambda: is_bomb(list('34567'))
+
+    for size in HAND_SIZES:
+        hand = make_hand(size, rng)
+        played = rng.sample(hand, 4)
+        rest = hand[:]
+        for c in played:
+            rest.remove(c)
+        shuffled = hand[:]
+        rng.shuffle(shuffled)
+
+        p = DdzPlayer('bench')
+        p.set_cards(hand[:])
+
+        # the methods mutate the hand, so every call starts from a fresh copy
+        def add_cards(p = p, rest = rest, played = played):
+            p.cards = rest[:]
+            p.add_cards(played)
+
+        def remove_cards(p = p, hand = hand, played = played):
+            p.cards = hand[:]
+            p.remove_cards(played)
+
+        def sort_cards(p = p, shuffled = shuffled):
+            p.cards = shuffled[:]
+            p.sort_cards()
+
+        server_player = Player(None, 'bench', TokenBucket(1, 1), TokenBucket(1, 1))
+        server_player.player_type = 'landlord'
+        server_player.cards = hand
+        msg = server_player.sync_msg(['player_type', 'cards'])
+
+        benches[f'check_have_cards/{size}'] = lambda p = p, played = played: p.check_have_cards(played)
+        benches[f'add_cards/{size}'] = add_cards
+        benches[f'remove_cards/{size}'] = remove_cards
+        benches[f'sort_cards/{size}'] = sort_cards
+        benches[f'sync_msg/{size}'] = lambda p = server_player: p.sync_msg(['player_type', 'cards'])
+        benches[f'encode_msg/{size}'] = lambda msg = msg: encode_msg(msg)
+
+    for peasants in [2, 3]:
+        ratings = [rng.uniform(1200, 1800) for i in range(peasants)]
+        benches[f'rating_deltas/{peasants}'] = lambda r = ratings: rating_deltas(32, 1500.0, r, True)
+
+    return benches
+
+
+def measure(fn, repeat: int) -> float:
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    # the minimum is the least disturbed by whatever else runs on the machine
+    return min(timer.repeat(repeat, number)) / number * 1e9
+
+
+def run_benchmarks(pattern: str, repeat: int, seed: int) -> dict:
+    results = {}
+    for name, fn in micro_benchmarks(seed).items():
+        if pattern not in name:
+            continue
+        results[name] = measure(fn, repeat)
+        print(f'{name:<24} {results[name]:>12.1f} ns')
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    regressions = []
+    print(f'{"benchmark":<24} {"baseline ns":>12} {"current ns":>12} {"change":>8}')
+    for name, ns in results.items():
+        if name not in baseline:
+            print(f'{name:<24} {"-":>12} {ns:>12.1f} {"new":>8}')
+            continue
+        change = ns / baseline[name] - 1
+        mark = ''
+        if change > threshold:
+            regressions.append(name)
+            mark = ' REGRESSION'
+        print(f'{name:<24} {baseline[name]:>12.1f} {ns:>12.1f} {change:>+8.1%}{mark}')
+    return regressions
+
+
+def bench_compression(kinds: list[str], count: int, threshold: int, level: int, seed: int):
+    print(f'{"kind":>8} {"raw B":>10} {"sent B":>10} {"ratio":>6} {"comp us":>8} {"decomp us":>9}')
+    for kind in kinds:
+        frames = compression_frames(kind, count, random.Random(seed))
+
+        compressor = zlib.compressobj(level)
+        start = time.perf_counter()
+        encoded = [encode_frame(f, compressor, threshold) for f in frames]
+        comp_time = time.perf_counter() - start
+
+        decompressor = zlib.decompressobj()
+        start = time.perf_counter()
+        for e in encoded:
+            if e[0] & 0x80:
+                decompressor.decompress(e[4:])
+        decomp_time = time.perf_counter() - start
+
+        raw = sum(len(f) + 4 for f in frames)
+        sent = sum(len(e) for e in encoded)
+        print(f'{kind:>8} {raw:>10} {sent:>10} {sent / raw:>6.2f} '
+              f'{comp_time / count * 1e6:>8.1f} {decomp_time / count * 1e6:>9.1f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description='benchmarks of ddz_py')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    compression = subparsers.add_parser('compression', help='bandwidth and CPU cost of message compression')
+    compression.add_argument('--kinds', help='comma separated frame kinds: sync<hand size>, list, chat',
+                             default='sync17,sync20,sync25,sync539,list,chat')
+    compression.add_argument('--count', help='frames sent over one connection', type=int, default=200)
+    compression.add_argument('--threshold', help='frames shorter than this are not compressed', type=int, default=256)
+    compression.add_argument('--level', help='zlib compression level', type=int, default=6)
+    compression.add_argument('--seed', type=int, default=0)
+
+    run = subparsers.add_parser('run', help='run the micro benchmarks')
+    run.add_argument('--save', help='save the results as a baseline to this file')
+
+    cmp = subparsers.add_parser('compare', help='run the micro benchmarks and compare them with a baseline')
+    cmp.add_argument('--baseline', help='baseline file to compare with', default=DEFAULT_BASELINE)
+    cmp.add_argument('--threshold', help='slowdown ratio reported as a regression', type=float, default=0.2)
+
+    for p in (run, cmp):
+        p.add_argument('--filter', help='only run benchmarks whose name contains this', default='')
+        p.add_argument('--repeat', help='timing repetitions, the fastest one counts', type=int, default=5)
+        p.add_argument('--seed', type=int, default=0)
+
+    args = parser.parse_args()
+
+    if args.command == 'compression':
+        bench_compression(args.kinds.split(','), args.count, args.threshold, args.level, args.seed)
+    elif args.command == 'run':
+        results = run_benchmarks(args.filter, args.repeat, args.seed)
+        if args.save is not None:
+            with open(args.save, 'w') as f:
+                json.dump({'python': sys.version.split()[0], 'results': results}, f, indent=2)
+                f.write('\n')
+    elif args.command == 'compare':
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        results = run_benchmarks(args.filter, args.repeat, args.seed)
+        print()
+        regressions = compare(results, baseline, args.threshold)
+        if len(regressions) != 0:
+            print(f'{len(regressions)} regression(s) over {args.threshold:.0%}: {", ".join(regressions)}')
+            sys.exit(1)
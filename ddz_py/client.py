@@ -1,51 +1,125 @@
 import asyncio
 import json
+import time
+import zlib
 
-from .protocol import encode_msg
+from .protocol import encode_msg, read_msg
 from .data import DdzPlayer
+from .stats import LatencyStats
 
 
 class DdzClient:
-    def __init__(self, hostname: str, port: int, name: str):
+    def __init__(self, hostname: str, port: int, name: str, compress: bool = False,
+                 trace: bool = False, report_interval: float = 10.0):
         self.hostname = hostname
         self.port = port
         self.data = DdzPlayer(name)
+        self.compress = compress
+
+        self.trace = trace
+        self.report_interval = report_interval
+        self.next_id = 0
+        # id -> time sent, of messages not acked yet
+        self.inflight: dict[int, float] = {}
+        self.rtt_stats = LatencyStats()
+        self.render_stats = LatencyStats()
+        self.unreported_rtt: list[float] = []
+        self.unreported_render: list[float] = []
+        self.last_report = time.monotonic()
+        # when the message being handled by the callback was received
+        self.received_at = 0.0
 
     async def connect(self):
         self.reader, self.writer = await asyncio.open_connection(
                 self.hostname, self.port)
-        await self.send(json.dumps({
-            'type': 'join',
-            'name': self.data.name}))
+        join = {'type': 'join', 'name': self.data.name}
+        self.decompressor = None
+        if self.compress:
+            join['compress'] = ['zlib']
+            self.decompressor = zlib.decompressobj()
+        self.inflight.clear()
+        await self.send(json.dumps(join))
+
+    async def reconnect(self, retries: int = 20, interval: float = 0.5):
+        await self.close_writer()
+        # the next server tells us our seat, if any
+        self.data.player_type = 'spectator'
+        self.data.cards = []
+        for i in range(retries):
+            try:
+                await self.connect()
+                return
+            except OSError:
+                if i == retries - 1:
+                    raise
+                await asyncio.sleep(interval)
 
     async def send(self, msg: str):
         bmsg = encode_msg(msg)
         self.writer.write(bmsg)
         await self.writer.drain()
 
+    async def send_traced(self, body: dict):
+        if self.trace:
+            body['id'] = self.next_id
+            self.next_id += 1
+            if len(self.inflight) >= 1024:
+                # the server doesn't ack, e.g. an old one
+                self.inflight.pop(next(iter(self.inflight)))
+            self.inflight[body['id']] = time.monotonic()
+        await self.send(json.dumps(body))
+
+    def on_ack(self, body: dict):
+        sent = self.inflight.pop(body['id'], None)
+        if sent is None:
+            return
+        rtt = time.monotonic() - sent
+        self.rtt_stats.add(rtt)
+        self.unreported_rtt.append(rtt)
+
+    def record_render(self, seconds: float):
+        if not self.trace:
+            return
+        self.render_stats.add(seconds)
+        self.unreported_render.append(seconds)
+
+    async def report_latency(self):
+        now = time.monotonic()
+        if now - self.last_report < self.report_interval:
+            return
+        self.last_report = now
+        if len(self.unreported_rtt) == 0 and len(self.unreported_render) == 0:
+            return
+        await self.send(json.dumps({
+            'type': 'latency_report',
+            'rtt': self.unreported_rtt[-256:],
+            'render': self.unreported_render[-256:]}))
+        self.unreported_rtt = []
+        self.unreported_render = []
+
     async def close_writer(self):
         self.writer.close()
         await self.writer.wait_closed()
 
     async def handle_cmd(self, cmd: str):
-        await self.send(json.dumps({
+        await self.send_traced({
             'type': 'cmd',
-            'cmd': cmd}))
+            'cmd': cmd})
 
     async def handle_play(self, cards: str, player_type: str):
         cards = cards.upper()
         if not self.data.check_have_cards(list(cards)):
             raise Exception('you don\'t have these card(s)')
-        await self.send(json.dumps({
+        await self.send_traced({
             'type': 'play',
             'player_type': player_type,
-            'cards': cards}))
+            'cards': cards})
 
     async def handle_chat(self, msg: str, player_type: str):
-        await self.send(json.dumps({
+        await self.send_traced({
             'type': 'chat',
             'player_type': player_type,
-            'content': msg}))
+            'content': msg})
 
     async def handle_input(self, msg: str):
         if msg.startswith('!'):
@@ -60,11 +134,15 @@ class DdzClient:
     async def receive_message(self, cb):
         while True:
             try:
-                length = int.from_bytes(await self.reader.readexactly(4), byteorder = 'big')
-                body = json.loads(await self.reader.readexactly(length))
+                body = await read_msg(self.reader, self.decompressor)
             except Exception as e:
                 print(e)
                 break
+            self.received_at = time.monotonic()
+            if body['type'] == 'ack':
+                self.on_ack(body)
+                await self.report_latency()
+                continue
             if body['type'] == 'sync':
                 for change in body['attr']:
                     k, v = change['key'], change['val']
@@ -75,5 +153,17 @@ class DdzClient:
                             elif len(v) == 2:
                                 await self.handle_chat('Only 2 cards!', self.data.player_type)
                     setattr(self.data, k, v)
+            elif body['type'] == 'reconnect':
+                cb(body)
+                try:
+                    await self.reconnect()
+                except Exception as e:
+                    print(e)
+                    return
+                continue
+            # the callback reports the render time through record_render,
+            # possibly a frame later
             cb(body)
+            if self.trace:
+                await self.report_latency()
         await self.close_writer()
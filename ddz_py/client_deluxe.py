@@ -1,78 +1,102 @@
 import argparse
 import asyncio
+import functools
 import re
 
-from prompt_toolkit import PromptSession
-from prompt_toolkit.completion import WordCompleter
-from prompt_toolkit.patch_stdout import patch_stdout
+from .client import DdzClient
+from .render import DdzRenderer
 
-from colorama import just_fix_windows_console, Fore, Style
+# prompt_toolkit, colorama and hashlib are imported where they are used, so
+# that importing this module stays as cheap as importing the bare client.
 
-from .client import DdzClient
 
-import hashlib
+@functools.lru_cache(maxsize=4096)
+def color_name(name: str) -> str:
+    import hashlib
+    from colorama import Fore, Style
+
+    STYLES = [Style.DIM, Style.NORMAL, Style.BRIGHT]
+    COLORS = [Fore.RED, Fore.GREEN, Fore.YELLOW, Fore.BLUE, Fore.MAGENTA, Fore.CYAN, Fore.WHITE]
+
+    rand = int(hashlib.sha1(name.encode('utf-8')).hexdigest(), 16)
+
+    style = STYLES[rand % len(STYLES)]
+    color = COLORS[(rand // len(STYLES)) % len(COLORS)]
+
+    return style + color + name + Style.RESET_ALL
 
 
 class DdzClientDeluxe:
-    def __init__(self, hostname: str, port: int, name: str, enable_color: bool):
-        self.client = DdzClient(hostname, port, name)
+    def __init__(self, hostname: str, port: int, name: str, enable_color: bool, fps: float,
+                 compress: bool, trace: bool):
+        self.client = DdzClient(hostname, port, name, compress, trace)
+        self.renderer = DdzRenderer(fps, self.client.record_render)
 
         self.enable_color = enable_color
 
     def get_colored_name(self, name: str) -> str:
         if not self.enable_color:
             return name
-
-        STYLES = [Style.DIM, Style.NORMAL, Style.BRIGHT]
-        COLORS = [Fore.RED, Fore.GREEN, Fore.YELLOW, Fore.BLUE, Fore.MAGENTA, Fore.CYAN, Fore.WHITE]
-
-        rand = int(hashlib.sha1(name.encode('utf-8')).hexdigest(), 16)
-
-        style = STYLES[rand % len(STYLES)]
-        color = COLORS[(rand // len(STYLES)) % len(COLORS)]
-
-        return style + color + name + Style.RESET_ALL
+        return color_name(name)
 
     def get_prefixed_colored_name(self, name: str, player_type: str) -> str:
         return f'[{player_type}] {self.get_colored_name(name)}'
 
-    def receive_message_cb(self, data):
-        if data['type'] == 'tell':
+    def format_message(self, data) -> list[str]:
+        lines = []
+        if data['type'] == 'chat_history':
+            for chat in data['messages']:
+                lines.extend(self.format_message(chat))
+        elif data['type'] == 'tell':
             for s in data['content'].splitlines():
-                print(f'[server] {s}')
+                lines.append(f'[server] {s}')
         elif data['type'] == 'chat':
             author = data['author']
             for s in data['content'].splitlines():
-                print(f'{self.get_prefixed_colored_name(author, data["player_type"])} > {s}')
+                lines.append(f'{self.get_prefixed_colored_name(author, data["player_type"])} > {s}')
         elif data['type'] == 'play':
-            print(f'{self.get_prefixed_colored_name(data["player"], data["player_type"])} {data["cards"]}')
+            lines.append(f'{self.get_prefixed_colored_name(data["player"], data["player_type"])} {data["cards"]}')
         elif data['type'] == 'rating_update':
-            print('k = ', data['k'])
+            lines.append(f'k =  {data["k"]}')
             for d in data['delta']:
-                print(self.get_colored_name(d['name']), d['delta'], d['rating'], sep = '\t')
+                lines.append(f'{self.get_colored_name(d["name"])}\t{d["delta"]}\t{d["rating"]}')
         elif data['type'] == 'error':
-            print(f'[error] {data["what"]}')
+            lines.append(f'[error] {data["what"]}')
+        elif data['type'] == 'reconnect':
+            lines.append('[server] Reconnecting...')
         elif data['type'] == 'sync':
             for change in data['attr']:
                 k, v = change['key'], change['val']
                 if k == 'player_type':
-                    print(f'You are {v} now')
+                    lines.append(f'You are {v} now')
                 elif k == 'cards':
-                    print(''.join(v))
+                    lines.append(''.join(v))
                 elif k == 'always_spectator':
                     if v:
-                        print('You are an always spectator now.')
+                        lines.append('You are an always spectator now.')
+                    else:
+                        lines.append('You are a normal player now.')
+                elif k == 'clock' and v is not None:
+                    if v['kind'] == 'bid':
+                        lines.append(f'{v["remaining"]:.0f}s left to become landlord')
                     else:
-                        print('You are a normal player now.')
+                        lines.append(f'{self.get_colored_name(v["player"])}: {v["remaining"]:.0f}s left to play')
         elif data['type'] == 'start':
             for i in data['players']:
-                print(i['role'], self.get_colored_name(i['name']), sep = '\t')
+                lines.append(f'{i["role"]}\t{self.get_colored_name(i["name"])}')
         else:
-            print(data)
+            lines.append(str(data))
+        return lines
+
+    def receive_message_cb(self, data):
+        self.renderer.push(self.format_message(data), self.client.received_at)
 
     async def receive_input(self):
+        from prompt_toolkit import PromptSession
+        from prompt_toolkit.completion import WordCompleter
+
         cmd_completer = WordCompleter(
-                ['/start', '/start4', '/start_any', '/list', '/rating', '/remain', '/toggle_spectator', '/undo', '/become_landlord'],
+                lambda: self.client.data.commands,
                 pattern=re.compile(r"([a-zA-Z0-9_/]+|[^a-zA-Z0-9_/\s]+)")
                 )
         session = PromptSession(completer=cmd_completer)
@@ -86,13 +110,18 @@ class DdzClientDeluxe:
                 print(e)
 
     async def run(self):
+        from prompt_toolkit.patch_stdout import patch_stdout
+
         await self.client.connect()
         with patch_stdout(True):
             try:
+                render_task = asyncio.create_task(self.renderer.run())
                 receive_task = asyncio.create_task(self.client.receive_message(self.receive_message_cb))
                 await self.receive_input()
             finally:
                 receive_task.cancel()
+                render_task.cancel()
+                self.renderer.flush()
                 await self.client.close_writer()
 
 
@@ -103,10 +132,17 @@ if __name__ == '__main__':
     parser.add_argument('port', help='the port of the ddz_py server', type=int)
     parser.add_argument('name', help='your username')
     parser.add_argument('--color', action=argparse.BooleanOptionalAction, default=True)
+    parser.add_argument('--fps', help='how many times per second the output is refreshed, 0 to print immediately',
+                        type=float, default=30.0)
+    parser.add_argument('--compress', help='ask the server to compress large messages',
+                        action=argparse.BooleanOptionalAction, default=False)
+    parser.add_argument('--trace', help='measure latency and report it to the server', action='store_true')
 
     args = parser.parse_args()
 
+    from colorama import just_fix_windows_console
     just_fix_windows_console()
 
-    client = DdzClientDeluxe(args.hostname, args.port, args.name, args.color)
+    client = DdzClientDeluxe(args.hostname, args.port, args.name, args.color, args.fps,
+                             args.compress, args.trace)
     asyncio.run(client.run())
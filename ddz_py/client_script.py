@@ -0,0 +1,79 @@
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from .client import DdzClient
+from .client_vanilla import AsyncStdin
+
+
+class DdzClientScript:
+    def __init__(self, hostname: str, port: int, name: str, script: str,
+                 delay: float, linger: float, quiet: bool, compress: bool, trace: bool):
+        self.client = DdzClient(hostname, port, name, compress, trace)
+        self.script = script
+        self.delay = delay
+        self.linger = linger
+        self.quiet = quiet
+
+    def receive_message_cb(self, data):
+        if not self.quiet:
+            print(json.dumps(data, ensure_ascii=False), flush=True)
+        self.client.record_render(time.monotonic() - self.client.received_at)
+
+    async def read_lines(self):
+        if self.script == '-':
+            stdin = AsyncStdin()
+            while True:
+                line = await stdin.readline()
+                if line == '':
+                    break
+                yield line
+        else:
+            with open(self.script) as f:
+                for line in f:
+                    yield line
+
+    async def receive_input(self):
+        async for line in self.read_lines():
+            line = line.strip()
+            if line == '' or line.startswith('#'):
+                continue
+            try:
+                await self.client.handle_input(line)
+            except Exception as e:
+                print(e, file=sys.stderr)
+            if self.delay > 0:
+                await asyncio.sleep(self.delay)
+
+    async def run(self):
+        await self.client.connect()
+        try:
+            receive_task = asyncio.create_task(self.client.receive_message(self.receive_message_cb))
+            await self.receive_input()
+            await asyncio.sleep(self.linger)
+        finally:
+            receive_task.cancel()
+            await self.client.close_writer()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description='non-interactive client of ddz_py, one input line per line of the script')
+    parser.add_argument('hostname', help='the hostname of the ddz_py server')
+    parser.add_argument('port', help='the port of the ddz_py server', type=int)
+    parser.add_argument('name', help='your username')
+    parser.add_argument('script', help='file to read input lines from, `-\' for stdin', nargs='?', default='-')
+    parser.add_argument('--delay', help='seconds to wait after sending each line', type=float, default=0.0)
+    parser.add_argument('--linger', help='seconds to keep receiving after the script ends', type=float, default=1.0)
+    parser.add_argument('--quiet', help='don\'t print received messages', action='store_true')
+    parser.add_argument('--compress', help='ask the server to compress large messages', action='store_true')
+    parser.add_argument('--trace', help='measure latency and report it to the server', action='store_true')
+
+    args = parser.parse_args()
+
+    client = DdzClientScript(args.hostname, args.port, args.name, args.script,
+                             args.delay, args.linger, args.quiet, args.compress,
+                             args.trace)
+    asyncio.run(client.run())
@@ -1,57 +1,106 @@
 import argparse
 import asyncio
+import os
 import sys
 
+from typing import Union
+
 from .client import DdzClient
+from .render import DdzRenderer
+
+
+class AsyncStdin:
+    def __init__(self):
+        self.reader: Union[None, asyncio.StreamReader] = None
+        self.use_thread = False
+
+    def on_readable(self):
+        # the fd is readable, so os.read won't block; unlike connect_read_pipe
+        # this leaves the fd blocking, which matters when it's the tty that
+        # stdout writes to as well
+        data = os.read(sys.stdin.fileno(), 65536)
+        if len(data) == 0:
+            asyncio.get_running_loop().remove_reader(sys.stdin.fileno())
+            self.reader.feed_eof()
+        else:
+            self.reader.feed_data(data)
 
+    def open(self):
+        self.reader = asyncio.StreamReader()
+        try:
+            asyncio.get_running_loop().add_reader(sys.stdin.fileno(), self.on_readable)
+        except (NotImplementedError, PermissionError, ValueError):
+            # Windows event loops and regular files can't be watched
+            self.use_thread = True
 
-# from https://stackoverflow.com/a/65326191/18180934
-async def ainput():
-    return (await asyncio.get_event_loop().run_in_executor(
-            None, sys.stdin.readline))
+    async def readline(self) -> str:
+        if self.reader is None:
+            self.open()
+        if self.use_thread:
+            return await asyncio.get_running_loop().run_in_executor(None, sys.stdin.readline)
+        line = await self.reader.readline()
+        return line.decode(sys.stdin.encoding or 'utf-8', errors='replace')
 
 
 class DdzClientVanilla:
-    def __init__(self, hostname: str, port: int, name: str):
-        self.client = DdzClient(hostname, port, name)
+    def __init__(self, hostname: str, port: int, name: str, fps: float, compress: bool,
+                 trace: bool):
+        self.client = DdzClient(hostname, port, name, compress, trace)
+        self.renderer = DdzRenderer(fps, self.client.record_render)
 
-    def receive_message_cb(self, data):
-        if data['type'] == 'tell':
+    def format_message(self, data) -> list[str]:
+        lines = []
+        if data['type'] == 'chat_history':
+            for chat in data['messages']:
+                lines.extend(self.format_message(chat))
+        elif data['type'] == 'tell':
             for s in data['content'].splitlines():
-                print(f'[server] {s}')
+                lines.append(f'[server] {s}')
         elif data['type'] == 'chat':
             author = data['author']
             for s in data['content'].splitlines():
-                print(f'{author}> {s}')
+                lines.append(f'{author}> {s}')
         elif data['type'] == 'play':
-            print(data['player'], data['cards'])
+            lines.append(f'{data["player"]} {data["cards"]}')
         elif data['type'] == 'rating_update':
-            print('k = ', data['k'])
+            lines.append(f'k =  {data["k"]}')
             for d in data['delta']:
-                print(d['name'], d['delta'], d['rating'], sep = '\t')
+                lines.append(f'{d["name"]}\t{d["delta"]}\t{d["rating"]}')
         elif data['type'] == 'error':
-            print(f'[error] {data["what"]}')
+            lines.append(f'[error] {data["what"]}')
+        elif data['type'] == 'reconnect':
+            lines.append('[server] Reconnecting...')
         elif data['type'] == 'sync':
             for change in data['attr']:
                 k, v = change['key'], change['val']
                 if k == 'player_type':
-                    print(f'You are {v} now')
+                    lines.append(f'You are {v} now')
                 elif k == 'cards':
-                    print(''.join(v))
+                    lines.append(''.join(v))
                 elif k == 'always_spectator':
                     if v:
-                        print('You are an always spectator now.')
+                        lines.append('You are an always spectator now.')
+                    else:
+                        lines.append('You are a normal player now.')
+                elif k == 'clock' and v is not None:
+                    if v['kind'] == 'bid':
+                        lines.append(f'{v["remaining"]:.0f}s left to become landlord')
                     else:
-                        print('You are a normal player now.')
+                        lines.append(f'{v["player"]}: {v["remaining"]:.0f}s left to play')
         elif data['type'] == 'start':
             for i in data['players']:
-                print(i['role'], i['name'], sep = '\t')
+                lines.append(f'{i["role"]}\t{i["name"]}')
         else:
-            print(data)
+            lines.append(str(data))
+        return lines
+
+    def receive_message_cb(self, data):
+        self.renderer.push(self.format_message(data), self.client.received_at)
 
     async def receive_input(self):
+        stdin = AsyncStdin()
         while True:
-            msg = await ainput()
+            msg = await stdin.readline()
             if msg == '':
                 break
             try:
@@ -62,10 +111,13 @@ class DdzClientVanilla:
     async def run(self):
         await self.client.connect()
         try:
+            render_task = asyncio.create_task(self.renderer.run())
             receive_task = asyncio.create_task(self.client.receive_message(self.receive_message_cb))
             await self.receive_input()
         finally:
             receive_task.cancel()
+            render_task.cancel()
+            self.renderer.flush()
             await self.client.close_writer()
 
 
@@ -75,8 +127,14 @@ if __name__ == '__main__':
     parser.add_argument('hostname', help='the hostname of the ddz_py server')
     parser.add_argument('port', help='the port of the ddz_py server', type=int)
     parser.add_argument('name', help='your username')
+    parser.add_argument('--fps', help='how many times per second the output is refreshed, 0 to print immediately',
+                        type=float, default=30.0)
+    parser.add_argument('--compress', help='ask the server to compress large messages',
+                        action=argparse.BooleanOptionalAction, default=False)
+    parser.add_argument('--trace', help='measure latency and report it to the server', action='store_true')
 
     args = parser.parse_args()
 
-    client = DdzClientVanilla(args.hostname, args.port, args.name)
+    client = DdzClientVanilla(args.hostname, args.port, args.name, args.fps, args.compress,
+                              args.trace)
     asyncio.run(client.run())
@@ -0,0 +1,75 @@
+import time
+
+from typing import Callable, Union
+
+from .stats import LatencyStats
+
+
+class DdzHandler:
+    def __init__(self, name: str, fn: Callable):
+        self.name = name
+        self.fn = fn
+
+    async def call(self, stats: LatencyStats, owner, *args):
+        start = time.perf_counter()
+        try:
+            await self.fn(owner, *args)
+        finally:
+            stats.add(time.perf_counter() - start)
+
+
+class DdzCommand(DdzHandler):
+    def __init__(self, name: str, fn: Callable, args: tuple[tuple[str, type], ...],
+                 varargs: Union[None, str], help: str, checks: tuple[Callable, ...], cost: float):
+        DdzHandler.__init__(self, name, fn)
+        self.args = args
+        self.varargs = varargs
+        self.help = help
+        self.checks = checks
+        self.cost = cost
+
+    def usage(self) -> str:
+        words = [f'/{self.name}'] + [f'<{name}>' for name, _ in self.args]
+        if self.varargs is not None:
+            words.append(f'[{self.varargs}...]')
+        return ' '.join(words)
+
+    def parse(self, words: list[str]) -> list:
+        if len(words) < len(self.args) or (self.varargs is None and len(words) > len(self.args)):
+            raise Exception(f'Usage: {self.usage()}')
+        try:
+            args = [conv(w) for (_, conv), w in zip(self.args, words)]
+        except ValueError:
+            raise Exception(f'Usage: {self.usage()}')
+        if self.varargs is not None:
+            args.append(words[len(self.args):])
+        return args
+
+
+class DdzRegistry:
+    def __init__(self):
+        self.handlers: dict[str, DdzHandler] = {}
+
+    def message(self, name: str):
+        def register(fn: Callable) -> Callable:
+            self.handlers[name] = DdzHandler(name, fn)
+            return fn
+        return register
+
+    def command(self, name: str, args: tuple[tuple[str, type], ...] = (),
+                varargs: Union[None, str] = None, help: str = '',
+                checks: tuple[Callable, ...] = (), cost: float = 1.0):
+        def register(fn: Callable) -> Callable:
+            self.handlers[name] = DdzCommand(name, fn, args, varargs, help, checks, cost)
+            return fn
+        return register
+
+    def get(self, name: str) -> Union[None, DdzHandler]:
+        return self.handlers.get(name)
+
+    def names(self) -> list[str]:
+        return list(self.handlers)
+
+    def new_stats(self) -> dict[str, LatencyStats]:
+        # the registry belongs to the class, the stats to every instance
+        return {name: LatencyStats() for name in self.handlers}
@@ -1,4 +1,6 @@
 from collections import Counter
+from typing import Union
+
 from .card import card_rank
 
 
@@ -8,6 +10,10 @@ class DdzPlayer:
         self.player_type = 'spectator'
         self.cards: list[str] = []
         self.always_spectator = False
+        # commands the server knows, synced when joining
+        self.commands: list[str] = []
+        # the running turn or bidding clock, synced by the server
+        self.clock: Union[None, dict] = None
 
     def check_have_cards(self, cards: list[str]) -> bool:
         cnt_hand = Counter(self.cards)
@@ -0,0 +1,92 @@
+import numpy as np
+
+from typing import Union
+
+from .card import suit_cards, card_rank
+
+
+RANKS = len(card_rank)
+
+
+def rank_counts(cards: list[str]) -> np.ndarray:
+    return np.bincount([card_rank[c] for c in cards], minlength=RANKS)
+
+
+def chain_savings(present: np.ndarray, min_len: int) -> np.ndarray:
+    # moves saved by playing runs of at least min_len consecutive ranks from 3
+    # to A at once, given which ranks of every hand take part
+    run = np.zeros(present.shape[:-1])
+    saved = np.zeros(present.shape[:-1])
+    for r in range(12):
+        saved += np.where(~present[..., r] & (run >= min_len), run - 1, 0)
+        run = np.where(present[..., r], run + 1, 0)
+    saved += np.where(run >= min_len, run - 1, 0)
+    return saved
+
+
+def hand_moves(counts: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # How many moves every hand in a (..., RANKS) matrix of rank counts needs
+    # to be emptied, and how many of them can't be beaten: a joker, a rocket,
+    # a bomb, or half a 2 as the other 2s may be out against it. Loops only go
+    # over the ranks, never over the cards.
+    normal = counts[..., :13]
+
+    bombs = (normal // 4).sum(-1)
+    rockets = np.minimum(counts[..., 13], counts[..., 14])
+    jokers = counts[..., 13] + counts[..., 14] - rockets
+    control = jokers + bombs + 0.5 * counts[..., 12]
+
+    # every rank is played as singles, pairs, triples or bombs, at most 4 at
+    # once, a rocket in one move
+    rest = normal % 4
+    moves = (bombs + (rest > 0).sum(-1) + jokers - rockets).astype(float)
+    # triples take a single or a pair along
+    moves -= np.minimum((rest == 3).sum(-1), ((rest == 1) | (rest == 2)).sum(-1))
+
+    # straights of 5 singles or more, and chains of 3 pairs or more, are
+    # played in one move
+    moves -= chain_savings(rest == 1, 5) + chain_savings(rest == 2, 3)
+
+    return moves, control
+
+
+def landlord_odds(hand: list[str], players: int, suit: int, samples: int = 2000,
+                  seed: Union[None, int] = None) -> float:
+    # Monte Carlo estimate of the chance to win as landlord: deal the cards
+    # this player can't see to the landlord's extra cards and to the other
+    # players many times, and count the deals where the landlord's hand runs
+    # out before every peasant's by hand_moves.
+    cards_each = len(hand)
+    extra = suit * len(suit_cards) - players * cards_each
+    if players < 2 or cards_each == 0 or extra < 0:
+        raise Exception('impossible deal')
+
+    deck = np.bincount([card_rank[c] for c in suit_cards], minlength=RANKS) * suit
+    own = rank_counts(hand)
+    unseen_counts = deck - own
+    if (unseen_counts < 0).any():
+        raise Exception('the hand has more cards than the deck')
+    unseen = np.repeat(np.arange(RANKS), unseen_counts)
+
+    rng = np.random.default_rng(seed)
+    deals = rng.permuted(np.broadcast_to(unseen, (samples, len(unseen))), axis=1)
+    offset = (np.arange(samples) * RANKS)[:, None]
+
+    def counts_of(begin: int, end: int) -> np.ndarray:
+        return np.bincount((deals[:, begin:end] + offset).ravel(),
+                           minlength=samples * RANKS).reshape(samples, RANKS)
+
+    landlord_moves, landlord_control = hand_moves(own + counts_of(0, extra))
+    peasants = [hand_moves(counts_of(extra + i * cards_each, extra + (i + 1) * cards_each))
+                for i in range(players - 1)]
+
+    # Every move that can't be beaten wins the lead back, which saves a move,
+    # but only as long as the other side still has moves to take the lead
+    # with. The landlord plays first, so a tie is the landlord's; the peasants
+    # win as soon as any of them runs out.
+    wins = np.ones(samples, dtype=bool)
+    for peasant_moves, peasant_control in peasants:
+        landlord_left = landlord_moves - np.minimum(landlord_control, peasant_moves)
+        peasant_left = peasant_moves - np.minimum(peasant_control, landlord_moves)
+        wins &= landlord_left <= peasant_left
+    return float(wins.mean())
@@ -1,6 +1,9 @@
 '''
-| body length | body (json) |
-|      4B     |             |
+| flag | body length | body (json) |
+|  1b  |     31b     |             |
+
+The highest bit of the 4-byte header is set when the body is compressed, see
+'join' below.
 
 Messages are serialized into json. The message object must have a property
 named 'type' which indicates the type of the message. There're serveral message
@@ -27,15 +30,26 @@ content read from property 'content', encoded utf-8.
 
 Type 'sync' (s2c): Client need to make its data as same as the property 'attr', which
 is a list of key-value pair. Note that val may be str, list[str], or bool, etc.
+Right after joining, the server syncs 'commands', the commands it understands.
+Key 'clock' is synced to everyone whenever a turn or bidding clock starts or
+stops, val is null or {"kind": "turn" | "bid", "player": "..." | null,
+"remaining": seconds}.
 
 {
   "type": "join",
-  "name": "..."
+  "name": "...",
+  "compress": ["zlib"] // optional
 }
 
 Type 'join' (c2s): Client should send this message as the first message when joining
 the server. Property name is the name of the client, encoded utf-8.
 
+If property 'compress' contains "zlib", the server may compress the messages it
+sends to this client. Compressed bodies are a zlib stream shared by the whole
+connection, each one ends with a sync flush, so the client must decompress them
+in order with one decompressor. Small messages are sent uncompressed. Messages
+from the client are never compressed.
+
 {
   "type": "chat",
   "content": "...",
@@ -55,6 +69,23 @@ then server should broadcast the message using the following type.
 Type 'chat' (s2c): Server broadcasting the message authored by some client,
 with property 'author' containing the name of the message author.
 
+{
+  "type": "chat_history",
+  "messages": [
+    {
+      "type": "chat",
+      "author": "...",
+      "content": "...",
+      "player_type": "..."
+    },
+    ...
+  ]
+}
+
+Type 'chat_history' (s2c): Server sends the most recent chat messages, oldest
+first, in one message right after a client joins. It's omitted when there's no
+chat yet.
+
 {
   "type": "play",
   "cards": "...",
@@ -119,9 +150,66 @@ some command.
 Type 'start' (s2c): Server send this type of message when a new game start. The
 message describes the players participating the game.
 
+{
+  "type": "reconnect"
+}
+
+Type 'reconnect' (s2c): Server is restarting and will close the connection right
+after this message. Client should connect again and send 'join'; a game the
+client was playing is resumed by the next server.
+
+Messages 'chat', 'play' and 'cmd' (c2s) may have an integer property 'id'. The
+server answers every message with an 'id' after handling it:
+
+{
+  "type": "ack",
+  "id": ...,     // int, id of the message
+  "ts": ...,     // float, unix time when the server received the message
+  "handle": ..., // float, seconds the server spent handling the message
+}
+
+Type 'ack' (s2c): The message with this id has been handled, the client can
+use it to measure round-trip time.
+
+{
+  "type": "latency_report",
+  "rtt": [...],   // list[float], round-trip times in seconds
+  "render": [...] // list[float], seconds from receiving to displaying a message
+}
+
+Type 'latency_report' (c2s): Client reports the samples it measured since its
+last report. Admins query the aggregation with `/latency'.
+
 '''
 
+import asyncio
+import json
+import zlib
 
-def encode_msg(msg: str) -> bytes:
-    bmsg = msg.encode()
+
+COMPRESSED_FLAG = 1 << 31
+
+
+def encode_frame(bmsg: bytes, compressor = None, threshold: int = 0) -> bytes:
+    if compressor is not None and len(bmsg) >= threshold:
+        bmsg = compressor.compress(bmsg) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        return b''.join(((len(bmsg) | COMPRESSED_FLAG).to_bytes(4, byteorder='big'), bmsg))
     return b''.join((len(bmsg).to_bytes(4, byteorder='big'), bmsg))
+
+
+def encode_msg(msg: str, compressor = None, threshold: int = 0) -> bytes:
+    return encode_frame(msg.encode(), compressor, threshold)
+
+
+async def read_msg(reader: asyncio.StreamReader, decompressor = None) -> dict:
+    header = int.from_bytes(await reader.readexactly(4), byteorder = 'big')
+    body = await reader.readexactly(header & ~COMPRESSED_FLAG)
+    if header & COMPRESSED_FLAG:
+        if decompressor is None:
+            raise Exception('compressed message without negotiation')
+        body = decompressor.decompress(body)
+    msg = json.loads(body)
+    # every message is an object with a type, anything else is a broken peer
+    if not isinstance(msg, dict):
+        raise Exception('message is not a JSON object')
+    return msg
@@ -0,0 +1,27 @@
+import time
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.muted_until = 0.0
+
+    def refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def consume(self, cost: float = 1.0) -> bool:
+        self.refill(time.monotonic())
+        if self.tokens < cost:
+            return False
+        self.tokens -= cost
+        return True
+
+    def mute(self, seconds: float):
+        self.muted_until = time.monotonic() + seconds
+
+    def muted_for(self) -> float:
+        return max(0.0, self.muted_until - time.monotonic())
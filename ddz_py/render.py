@@ -0,0 +1,51 @@
+import asyncio
+import sys
+import time
+
+from typing import Callable, Union
+
+
+class DdzRenderer:
+    def __init__(self, fps: float, on_render: Union[None, Callable[[float], None]] = None):
+        self.interval = 1 / fps if fps > 0 else 0.0
+        self.lines: list[str] = []
+        # when the messages behind the pending lines were received, reported
+        # to on_render once the lines are really written
+        self.received: list[float] = []
+        self.on_render = on_render
+        self.pending = asyncio.Event()
+
+    def push(self, lines: list[str], received: Union[None, float] = None):
+        if len(lines) == 0:
+            return
+        self.lines.extend(lines)
+        if received is not None:
+            self.received.append(received)
+        if self.interval == 0:
+            self.flush()
+        else:
+            self.pending.set()
+
+    def flush(self):
+        if len(self.lines) == 0:
+            return
+        text = '\n'.join(self.lines)
+        self.lines = []
+        # look up sys.stdout every time since prompt_toolkit may patch it
+        sys.stdout.write(text + '\n')
+        sys.stdout.flush()
+
+        if self.on_render is not None:
+            now = time.monotonic()
+            for received in self.received:
+                self.on_render(now - received)
+        self.received = []
+
+    async def run(self):
+        if self.interval == 0:
+            return
+        while True:
+            await self.pending.wait()
+            self.pending.clear()
+            self.flush()
+            await asyncio.sleep(self.interval)
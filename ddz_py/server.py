@@ -2,40 +2,84 @@ import argparse
 import asyncio
 import dbm
 import json
+import math
+import os
 import random
+import signal
+import time
+import zlib
 
+from collections import deque
 from typing import Union
 
-from .protocol import encode_msg
+from .protocol import encode_frame, encode_msg, read_msg
 from .card import suit_cards, is_bomb, card_rank
+from .command import DdzRegistry
 from .data import DdzPlayer
+from .ratelimit import TokenBucket
+from .stats import LatencyStats
+from .timer import DdzTimer, DdzTimerWheel
+from .tournament import DdzTournament, TABLE_CONFIGS
+
+try:
+    from .odds import landlord_odds
+except ImportError:
+    # numpy is optional, only /odds needs it
+    landlord_odds = None
 
 
 class Player(DdzPlayer):
-    def __init__(self, writer: asyncio.StreamWriter, name: str):
+    def __init__(self, writer: asyncio.StreamWriter, name: str,
+                 chat_bucket: TokenBucket, cmd_bucket: TokenBucket,
+                 compressor = None, compress_threshold: int = 0):
         DdzPlayer.__init__(self, name)
         self.writer = writer
+        self.chat_bucket = chat_bucket
+        self.cmd_bucket = cmd_bucket
+        self.compressor = compressor
+        self.compress_threshold = compress_threshold
+        # the room whose game the player plays or watches
+        self.room: Union[None, 'DdzRoom'] = None
+
+        self.handle_stats = LatencyStats()
+        self.rtt_stats = LatencyStats()
+        self.render_stats = LatencyStats()
 
     async def send(self, msg: str):
-        self.writer.write(encode_msg(msg))
+        self.writer.write(encode_msg(msg, self.compressor, self.compress_threshold))
         await self.writer.drain()
 
     async def tell(self, msg: str):
         await self.send(json.dumps({'type': 'tell', 'content': msg}))
 
-    async def sync_data(self, keys: list[str]):
+    async def error(self, what: str):
+        await self.send(json.dumps({'type': 'error', 'what': what}))
+
+    def sync_msg(self, keys: list[str]) -> str:
         data = {
                 'type': 'sync',
                 'attr': list(map(
                     lambda k: {'key': k, 'val': getattr(self, k)}, keys))}
-        await self.send(json.dumps(data))
+        return json.dumps(data)
+
+    async def sync_data(self, keys: list[str]):
+        await self.send(self.sync_msg(keys))
 
 
 class DdzStatusWaitForLandlord:
-    def __init__(self, players: list[Player], landlord_cards: list[str]):
+    def __init__(self, players: list[Player], landlord_cards: list[str], suit: int):
         self.players = players
         self.landlord_cards = landlord_cards
         self.landlord_cards.sort(key = lambda x: card_rank[x])
+        self.suit = suit
+
+    def snapshot(self) -> dict:
+        return {
+                'status': 'wait_for_landlord',
+                'players': [p.name for p in self.players],
+                'landlord_cards': self.landlord_cards,
+                'suit': self.suit,
+                }
 
 
 class DdzStatusStarted:
@@ -45,6 +89,15 @@ class DdzStatusStarted:
         self.idx = 0
         self.played_stack: list[tuple[Player, str]] = []
 
+    def snapshot(self) -> dict:
+        return {
+                'status': 'started',
+                'players': [p.name for p in self.player_ord],
+                'current_K': self.current_K,
+                'idx': self.idx,
+                'played_stack': [[p.name, cards] for p, cards in self.played_stack],
+                }
+
     def front(self):
         return self.player_ord[self.idx]
 
@@ -58,6 +111,41 @@ class DdzStatusStarted:
         self.current_K >>= 1
 
 
+class DdzRoom:
+    def __init__(self, name: str, table: Union[None, list[str]] = None):
+        self.name = name
+        # the tournament table played in this room
+        self.table = table
+        # players seated in the game and spectators watching it
+        self.members: list[Player] = []
+        self.status: Union[None, DdzStatusWaitForLandlord, DdzStatusStarted] = None
+        self.clock: Union[None, DdzTimer] = None
+        self.clock_kind = ''
+        self.clock_player: Union[None, Player] = None
+        # snapshot of the game handed over by the previous server, until all
+        # of its players have reconnected
+        self.restoring: Union[None, dict] = None
+
+    def busy(self) -> bool:
+        return self.status is not None or self.restoring is not None
+
+    def status_players(self) -> list[Player]:
+        if isinstance(self.status, DdzStatusWaitForLandlord):
+            return self.status.players
+        return self.status.player_ord
+
+    def snapshot(self) -> Union[None, dict]:
+        if self.restoring is not None:
+            return self.restoring
+        if self.status is None:
+            return None
+        game = self.status.snapshot()
+        game['seats'] = {p.name: {'player_type': p.player_type, 'cards': p.cards}
+                         for p in self.status_players()}
+        game['table'] = self.table
+        return game
+
+
 def get_rating(db, name: str) -> float:
     res = db.get(name.encode())
     if res is None:
@@ -70,24 +158,170 @@ def set_rating(db, name: str, rating: float):
     db[name.encode()] = str(rating).encode()
 
 
+def rating_deltas(K: int, landlord_rating: float, peasants_rating: list[float],
+                  landlord_wins: bool) -> list[float]:
+    # delta of the landlord against each peasant, the landlord gets the sum
+    deltas = []
+    for p in peasants_rating:
+        diff = (p - landlord_rating) / 400
+        if abs(diff) < 100:
+            exp = 1 / (1 + 10**(diff))
+        else:
+            exp = diff < 0
+
+        deltas.append(K * (landlord_wins - exp))
+    return deltas
+
+
+def latency_samples(value, limit: int = 256) -> list[float]:
+    # reports come from clients, keep only what can be a duration in seconds
+    if not isinstance(value, list):
+        return []
+    samples = []
+    for t in value[:limit]:
+        if isinstance(t, (int, float)) and not isinstance(t, bool) and math.isfinite(t) and t >= 0:
+            samples.append(float(t))
+    return samples
+
+
+def check_admin(server: 'DdzServer', executor: Player):
+    # everyone is an admin when no admin is given
+    if len(server.admins) != 0 and executor.name not in server.admins:
+        raise Exception('Only admins can do this.')
+
+
+def check_no_tournament(server: 'DdzServer', executor: Player):
+    if server.tournament is not None:
+        raise Exception('A tournament is running, games are started automatically.')
+
+
+def check_tournament(server: 'DdzServer', executor: Player):
+    if server.tournament is None:
+        raise Exception('No tournament is running.')
+
+
+def check_started(server: 'DdzServer', executor: Player):
+    if not isinstance(executor.room.status, DdzStatusStarted):
+        raise Exception('Game isn\'t started')
+
+
+def check_wait_for_landlord(server: 'DdzServer', executor: Player):
+    if not isinstance(executor.room.status, DdzStatusWaitForLandlord):
+        raise Exception('No one is choosing the landlord now.')
+    if executor not in executor.room.status.players:
+        raise Exception('You are not playing.')
+
+
 class DdzServer:
-    def __init__(self, addr: str, port: int, rating_db_path: str):
+    commands = DdzRegistry()
+    messages = DdzRegistry()
+
+    def __init__(self, addr: str, port: int, rating_db_path: str,
+                 chat_rate: float = 1.0, chat_burst: float = 5.0,
+                 cmd_rate: float = 2.0, cmd_burst: float = 10.0,
+                 rate_limit_policy: str = 'drop', mute_seconds: float = 30.0,
+                 chat_history: int = 50,
+                 tournament_state_path: Union[None, str] = None, absent_grace: float = 120.0,
+                 snapshot_path: Union[None, str] = None, drain_timeout: float = 300.0,
+                 restore_timeout: float = 60.0,
+                 reuse_port: bool = False, compress_threshold: int = 256,
+                 admins: Union[None, list[str]] = None,
+                 turn_time: float = 0.0, bid_time: float = 0.0, timeout_action: str = 'pass',
+                 clock_tick: float = 0.1):
         self.addr = addr
         self.port = port
         self.players: list[Player] = []
         self.rating_db_path = rating_db_path
         self.initial_K = 32
 
-        self.status: Union[None, DdzStatusWaitForLandlord, DdzStatusStarted] = None
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.cmd_rate = cmd_rate
+        self.cmd_burst = cmd_burst
+        if rate_limit_policy not in ('drop', 'mute'):
+            raise Exception(f'unknown rate limit policy: {rate_limit_policy}')
+        self.rate_limit_policy = rate_limit_policy
+        self.mute_seconds = mute_seconds
+        self.chat_history: deque[dict] = deque(maxlen=chat_history)
+
+        self.tournament_state_path = tournament_state_path
+        self.tournament: Union[None, DdzTournament] = None
+        if tournament_state_path is not None and os.path.exists(tournament_state_path):
+            tournament = DdzTournament.load(tournament_state_path)
+            if not tournament.finished():
+                self.tournament = tournament
+        # 0 means waiting for absent players forever
+        self.absent_grace = absent_grace
+        # tournament player -> when the tournament started waiting for them
+        self.absent_since: dict[str, float] = {}
+        self.absent_timer: Union[None, DdzTimer] = None
+
+        # games outside of tournaments are played in the lobby, where
+        # everyone who isn't at a tournament table is
+        self.lobby = DdzRoom('lobby')
+        self.rooms: list[DdzRoom] = [self.lobby]
+        self.room_cnt = 0
+
+        self.snapshot_path = snapshot_path
+        self.drain_timeout = drain_timeout
+        self.restore_timeout = restore_timeout
+        self.reuse_port = reuse_port
+        self.compress_threshold = compress_threshold
+
+        self.admins = set(admins or [])
+
+        # 0 means no time limit
+        self.turn_time = turn_time
+        self.bid_time = bid_time
+        if timeout_action not in ('pass', 'forfeit'):
+            raise Exception(f'unknown timeout action: {timeout_action}')
+        self.timeout_action = timeout_action
+        # all the clocks of the process share one wheel
+        self.timers = DdzTimerWheel(clock_tick)
+        # the event loop only keeps weak references to tasks, so the ones
+        # nobody awaits are kept here until they are done
+        self.tasks: set[asyncio.Task] = set()
+        self.handle_stats = LatencyStats()
+        self.command_stats = self.commands.new_stats()
+        self.message_stats = self.messages.new_stats()
+        self.broadcast_stats = LatencyStats()
+        self.rtt_stats = LatencyStats()
+        self.render_stats = LatencyStats()
+        self.draining = False
+        # aborts the games handed over by the previous server whose players
+        # don't come back
+        self.restore_timer: Union[None, DdzTimer] = None
 
     def choose_players(self, n):
-        candidate_players = list(filter(lambda p: not p.always_spectator, self.players))
+        candidate_players = list(filter(lambda p: not p.always_spectator, self.lobby.members))
         if len(candidate_players) < n:
             raise Exception('No enough players.')
         return random.sample(candidate_players, n)
 
-    async def deal_cards(self, player_cnt: int, cards_each: int, suit: int):
-        await self.cleanup()
+    def open_room(self, table: list[str]) -> DdzRoom:
+        self.room_cnt += 1
+        room = DdzRoom(f'table {self.room_cnt}', table)
+        self.rooms.append(room)
+        return room
+
+    def move_player(self, player: Player, room: DdzRoom):
+        if player.room is room:
+            return
+        if player.room is not None:
+            player.room.members.remove(player)
+        player.room = room
+        room.members.append(player)
+
+    async def deal_cards(self, room: DdzRoom, player_cnt: int, cards_each: int, suit: int,
+                         players: Union[None, list[Player]] = None):
+        if self.draining:
+            raise Exception('Server is going to restart, no new games.')
+        if room.restoring is not None:
+            raise Exception('Waiting for players of the resumed game.')
+        if self.handoff_expected():
+            raise Exception('Waiting for the game of the previous server.')
+
+        await self.reset_room(room)
 
         if cards_each <= 0:
             raise Exception('Every player should have at lease 1 card.')
@@ -98,32 +332,37 @@ class DdzServer:
         if suit > 10:
             raise Exception('Too much cards!')
 
-        players = self.choose_players(player_cnt)
+        if players is None:
+            players = self.choose_players(player_cnt)
 
         c = list(suit_cards * suit)
         random.shuffle(c)
 
         pos = 0
         for p in players:
+            self.move_player(p, room)
             p.player_type = 'undetermined'
             p.add_cards(c[pos:pos + cards_each])
             pos += cards_each
 
-        self.status = DdzStatusWaitForLandlord(players, c[pos:])
+        room.status = DdzStatusWaitForLandlord(players, c[pos:], suit)
 
         await self.broadcast(f'''Game is going to start! Players: {','.join(sorted(p.name for p in players))}.
-Use `/become_landlord' to become landlord.''')
+Use `/become_landlord' to become landlord.''', room.members)
 
         await asyncio.gather(*(
             p.sync_data(['player_type', 'cards']) for p in players
             ))
 
-    async def become_landlord(self, landlord: Player):
-        if not isinstance(self.status, DdzStatusWaitForLandlord):
+        await self.arm_clock(room, 'bid', None, self.bid_time)
+
+    async def become_landlord(self, room: DdzRoom, landlord: Player):
+        if not isinstance(room.status, DdzStatusWaitForLandlord):
             raise Exception('You can\'t become landlord now.')
+        self.disarm_clock(room)
 
-        landlord_cards = self.status.landlord_cards
-        players = self.status.players
+        landlord_cards = room.status.landlord_cards
+        players = room.status.players
 
         landlord.add_cards(landlord_cards)
 
@@ -140,23 +379,25 @@ Use `/become_landlord' to become landlord.''')
                 p.player_type = f'peasant {cnt}'
                 cnt += 1
 
-        self.status = DdzStatusStarted(self.initial_K, players)
+        room.status = DdzStatusStarted(self.initial_K, players)
 
         await asyncio.gather(*(
             p.sync_data(['player_type', 'cards']) for p in players
             ))
 
-        await self.broadcast(f'Landlord\'s extra cards are: {"".join(landlord_cards)}.')
+        await self.broadcast(f'Landlord\'s extra cards are: {"".join(landlord_cards)}.', room.members)
 
         await self.send_all(json.dumps({
             'type': 'start',
             'players': list(map(
                 lambda p: {'name': p.name, 'role': p.player_type},
-                players))}))
+                players))}), room.members)
+
+        await self.arm_clock(room, 'turn', room.status.front(), self.turn_time)
 
-    async def set_all_spectator(self):
+    async def set_all_spectator(self, room: DdzRoom):
         tasks = []
-        for p in self.players:
+        for p in room.members:
             if not p.player_type.startswith('spectator'):
                 p.player_type = 'spectator'
                 p.cards = []
@@ -164,88 +405,567 @@ Use `/become_landlord' to become landlord.''')
                 tasks.append(tp)
         await asyncio.gather(*tasks)
 
-    async def cleanup(self):
-        self.status = None
-        await self.set_all_spectator()
+    async def reset_room(self, room: DdzRoom):
+        room.status = None
+        room.restoring = None
+        await self.stop_clock(room)
+        await self.set_all_spectator(room)
+
+    async def cleanup(self, room: DdzRoom):
+        await self.reset_room(room)
+        if room is not self.lobby and room in self.rooms:
+            # the table is done, everyone goes back to the lobby
+            self.rooms.remove(room)
+            for p in room.members[:]:
+                self.move_player(p, self.lobby)
+        if self.restore_timer is not None and not any(r.restoring is not None for r in self.rooms):
+            self.timers.cancel(self.restore_timer)
+            self.restore_timer = None
+
+    def spawn(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def clock_msg(self, room: DdzRoom) -> str:
+        clock = None
+        if room.clock is not None:
+            clock = {
+                    'kind': room.clock_kind,
+                    'player': None if room.clock_player is None else room.clock_player.name,
+                    'remaining': round(self.timers.remaining(room.clock), 1)}
+        return json.dumps({'type': 'sync', 'attr': [{'key': 'clock', 'val': clock}]})
+
+    def disarm_clock(self, room: DdzRoom):
+        # called before the first await of every move, so that a clock firing
+        # while the move is being sent out can't act on the old turn
+        if room.clock is not None:
+            self.timers.cancel(room.clock)
+            room.clock = None
+
+    async def arm_clock(self, room: DdzRoom, kind: str, player: Union[None, Player], seconds: float):
+        self.disarm_clock(room)
+        if seconds <= 0:
+            return
+
+        def expire():
+            self.spawn(self.clock_expired(room, timer))
+
+        timer = self.timers.schedule(seconds, expire)
+        room.clock = timer
+        room.clock_kind = kind
+        room.clock_player = player
+        await self.send_all(self.clock_msg(room), room.members)
+
+    async def stop_clock(self, room: DdzRoom):
+        if room.clock is None:
+            return
+        self.timers.cancel(room.clock)
+        room.clock = None
+        await self.send_all(self.clock_msg(room), room.members)
+
+    async def clock_expired(self, room: DdzRoom, timer: DdzTimer):
+        # the clock may have been stopped or armed again in the meantime
+        if room.clock is not timer:
+            return
+        room.clock = None
+
+        try:
+            await self.clock_action(room)
+        except Exception as e:
+            print(e)
+            await self.send_all(json.dumps({
+                'type': 'error',
+                'what': str(e)}), room.members)
+
+    async def clock_action(self, room: DdzRoom):
+        if room.clock_kind == 'bid':
+            if not isinstance(room.status, DdzStatusWaitForLandlord):
+                return
+            players = room.status.players
+            if self.timeout_action == 'forfeit':
+                await self.broadcast('No one became landlord in time, game aborted.', room.members)
+                if self.tournament is not None and room.table is not None:
+                    self.tournament.abort(room.table)
+                await self.cleanup(room)
+                await self.tournament_advance()
+            elif self.draining:
+                # no new deal on a server going away, the next one picks the
+                # table up from the snapshot and starts a new bid clock
+                await self.broadcast('No one became landlord in time, waiting for the restart.', room.members)
+            else:
+                await self.broadcast('No one became landlord in time, dealing again.', room.members)
+                await self.deal_cards(room, len(players), len(players[0].cards), room.status.suit, players)
+        else:
+            if not isinstance(room.status, DdzStatusStarted) or room.status.front() is not room.clock_player:
+                return
+            player = room.clock_player
+            if self.timeout_action == 'forfeit':
+                await self.broadcast(f'{player.name} ran out of time and loses the game.', room.members)
+                await self.finish_game(room, not player.player_type.startswith('landlord'))
+            else:
+                await self.broadcast(f'{player.name} ran out of time and passes.', room.members)
+                await self.play_cards(room, player, [])
+
+    def standings_text(self) -> str:
+        lines = [f'Round {self.tournament.round}/{self.tournament.rounds}',
+                 'name\tpoints\twins\tgames\tbyes']
+        for name, s in self.tournament.ranking():
+            lines.append(f'{name}\t{s["points"]}\t{s["wins"]}\t{s["games"]}\t{s["byes"]}')
+        return '\n'.join(lines)
+
+    async def tournament_advance(self):
+        if self.tournament is None or self.draining or self.handoff_expected():
+            return
+
+        online = {p.name for p in self.players}
+        # players at a table, or at a game waiting to be resumed, can't be
+        # seated anywhere else
+        free = {p.name: p for p in self.players if p.player_type.startswith('spectator')}
+        tables = self.tournament.next_tables(set(free))
+        if len(tables) == 0 and self.tournament.finished():
+            # the last tables finish at the same time, announce it once
+            msg = self.standings_text()
+            self.tournament = None
+            await self.broadcast(f'Tournament finished!\n{msg}')
+            return
+        self.watch_absent(online)
+        if len(tables) == 0:
+            return
+
+        await self.broadcast(f'Tournament round {self.tournament.round}/{self.tournament.rounds}, '
+                             f'{len(tables)} table(s) starting, {len(self.tournament.playing)} playing, '
+                             f'{len(self.tournament.pending)} waiting for players.')
+        cards_each, suit = TABLE_CONFIGS[self.tournament.table_size]
+        for table in tables:
+            await self.deal_cards(self.open_room(table), self.tournament.table_size, cards_each, suit,
+                                  [free[name] for name in table])
+
+    def watch_absent(self, online: set[str]):
+        now = time.monotonic()
+        self.absent_since = {name: self.absent_since.get(name, now)
+                             for name in self.tournament.absent(online)}
+        if self.absent_grace <= 0 or len(self.absent_since) == 0 or self.absent_timer is not None:
+            return
+
+        def expire():
+            self.absent_timer = None
+            self.spawn(self.absent_expired())
+
+        delay = min(self.absent_since.values()) + self.absent_grace - now
+        self.absent_timer = self.timers.schedule(delay, expire)
+
+    async def absent_expired(self):
+        # only the tables still to be dealt wait for absent players, the
+        # running ones go on
+        if self.tournament is None or self.draining or self.handoff_expected():
+            return
+        online = {p.name for p in self.players}
+        now = time.monotonic()
+        # the wheel may fire up to a tick early
+        gone = [name for name in self.tournament.absent(online)
+                if now - self.absent_since.get(name, now) >= self.absent_grace - self.timers.tick]
+        if len(gone) != 0:
+            self.tournament.withdraw(gone)
+            await self.broadcast(f'{",".join(gone)} didn\'t show up for {self.absent_grace:g}s '
+                                 f'and left the tournament.')
+        await self.tournament_advance()
 
     async def exec_command(self, executor: Player, cmd: str):
         cmds = cmd.split()
         if len(cmds) == 0:
             return
-        if cmds[0] == 'start':
-            await self.deal_cards(3, 17, 1)
-        elif cmds[0] == 'start4':
-            await self.deal_cards(4, 25, 2)
-        elif cmds[0] == 'start_any':
-            people, each, suit = map(int, cmds[1:4])
-            await self.deal_cards(people, each, suit)
-        elif cmds[0] == 'list':
-            msg = '\n'.join(map(lambda p: f'{p.name} [{p.player_status_abbr()}]', self.players))
-            await executor.tell(msg)
-        elif cmds[0] == 'rating':
-            ratings = []
-            with dbm.open(self.rating_db_path, 'c') as db:
-                if len(cmds) == 1:
-                    ratings.append((executor.name, float(str(get_rating(db, executor.name)))))
-                else:
-                    for i in cmds[1:]:
-                        ratings.append((i, float(str(get_rating(db, i)))))
-            msg = '\n'.join((f'{r[0]}\t{r[1]:.3f}' for r in ratings))
-            await executor.tell(msg)
-        elif cmds[0] == 'remain':
-            remain = []
-            if len(cmds) == 1:
-                for p in self.players:
-                    if not p.player_type.startswith('spectator'):
-                        remain.append((p.name, len(p.cards)))
+        command = self.commands.get(cmds[0])
+        cost = 1.0 if command is None else command.cost
+        if not await self.check_rate_limit(executor, executor.cmd_bucket, 'commands', cost):
+            return
+        if command is None:
+            raise Exception('unknown command')
+        for check in command.checks:
+            check(self, executor)
+        await command.call(self.command_stats[command.name], self, executor, *command.parse(cmds[1:]))
+
+    @commands.command('start', help='deal 17 cards to 3 players', checks=(check_no_tournament,), cost=2.0)
+    async def cmd_start(self, executor: Player):
+        await self.deal_cards(self.lobby, 3, 17, 1)
+
+    @commands.command('start4', help='deal 25 cards of 2 suits to 4 players', checks=(check_no_tournament,), cost=2.0)
+    async def cmd_start4(self, executor: Player):
+        await self.deal_cards(self.lobby, 4, 25, 2)
+
+    @commands.command('start_any', args=(('people', int), ('each', int), ('suit', int)),
+                      help='deal <each> cards of <suit> suits to <people> players',
+                      checks=(check_no_tournament,), cost=2.0)
+    async def cmd_start_any(self, executor: Player, people: int, each: int, suit: int):
+        await self.deal_cards(self.lobby, people, each, suit)
+
+    @commands.command('list', help='list players in the server')
+    async def cmd_list(self, executor: Player):
+        lines = []
+        for p in self.players:
+            if p.room is self.lobby:
+                lines.append(f'{p.name} [{p.player_status_abbr()}]')
+            else:
+                lines.append(f'{p.name} [{p.player_status_abbr()}] at {p.room.name}')
+        await executor.tell('\n'.join(lines))
+
+    @commands.command('rating', varargs='players', help='show ratings, yours by default')
+    async def cmd_rating(self, executor: Player, names: list[str]):
+        ratings = []
+        with dbm.open(self.rating_db_path, 'c') as db:
+            if len(names) == 0:
+                ratings.append((executor.name, float(str(get_rating(db, executor.name)))))
             else:
-                for i in cmds[1:]:
-                    for p in self.players:
-                        if p.name == i:
-                            remain.append((i, len(p.cards)))
-                            break
-            msg = '\n'.join((f'{r[0]}\t{r[1]}' for r in remain))
-            await executor.tell(msg)
-        elif cmds[0] == 'toggle_spectator':
-            executor.always_spectator = not executor.always_spectator
-            await executor.sync_data(['always_spectator'])
-        elif cmds[0] == 'undo':
-
-            if len(self.status.played_stack) == 0:
-                raise Exception('No one played before')
-
-            if self.status.played_stack[-1][0] != executor:
-                raise Exception(f'The last player is not {executor.name} (expect {self.status.played_stack[-1][0].name})')
-
-            _, cards = self.status.played_stack.pop()
-            if is_bomb(cards):
-                self.status.decr_k()
-
-            executor.add_cards(cards)
-
-            self.status.shift(-1)
-
-            await self.broadcast(f'{executor.name} undos: {"".join(cards)}')
-            await executor.sync_data(['cards'])
-        elif cmds[0] == 'become_landlord':
-            await self.become_landlord(executor)
-        elif cmds[0] == 'help':
-            await executor.tell("""Avaliable Commands:
-/start, /start4, /start_any, /list, /rating, /remain, /toggle_spectator, /undo, /become_landlord
-Note:
-    /start_any <people> <each> <suit>""")
+                for i in names:
+                    ratings.append((i, float(str(get_rating(db, i)))))
+        msg = '\n'.join((f'{r[0]}\t{r[1]:.3f}' for r in ratings))
+        await executor.tell(msg)
+
+    @commands.command('remain', varargs='players', help='show how many cards are left, all players of your game by default')
+    async def cmd_remain(self, executor: Player, names: list[str]):
+        remain = []
+        if len(names) == 0:
+            for p in executor.room.members:
+                if not p.player_type.startswith('spectator'):
+                    remain.append((p.name, len(p.cards)))
         else:
-            raise Exception('unknown command')
+            for i in names:
+                for p in self.players:
+                    if p.name == i:
+                        remain.append((i, len(p.cards)))
+                        break
+        msg = '\n'.join((f'{r[0]}\t{r[1]}' for r in remain))
+        await executor.tell(msg)
+
+    @commands.command('toggle_spectator', help='never be dealt cards, or be a normal player again')
+    async def cmd_toggle_spectator(self, executor: Player):
+        executor.always_spectator = not executor.always_spectator
+        await executor.sync_data(['always_spectator'])
+
+    @commands.command('undo', help='take back your last play', checks=(check_started,))
+    async def cmd_undo(self, executor: Player):
+        room = executor.room
+        if len(room.status.played_stack) == 0:
+            raise Exception('No one played before')
+
+        if room.status.played_stack[-1][0] != executor:
+            raise Exception(f'The last player is not {executor.name} (expect {room.status.played_stack[-1][0].name})')
+
+        self.disarm_clock(room)
+        _, cards = room.status.played_stack.pop()
+        if is_bomb(cards):
+            room.status.decr_k()
+
+        executor.add_cards(cards)
+
+        room.status.shift(-1)
+
+        await self.broadcast(f'{executor.name} undos: {"".join(cards)}', room.members)
+        await executor.sync_data(['cards'])
+        await self.arm_clock(room, 'turn', room.status.front(), self.turn_time)
+
+    @commands.command('become_landlord', help='take the extra cards and be the landlord',
+                      checks=(check_wait_for_landlord,))
+    async def cmd_become_landlord(self, executor: Player):
+        await self.become_landlord(executor.room, executor)
+
+    @commands.command('odds', help='estimate your chance to win as landlord',
+                      checks=(check_wait_for_landlord,), cost=2.0)
+    async def cmd_odds(self, executor: Player):
+        start = time.perf_counter()
+        if landlord_odds is None:
+            raise Exception('/odds needs numpy on the server.')
+        status = executor.room.status
+        p = landlord_odds(executor.cards, len(status.players), status.suit)
+        elapsed = time.perf_counter() - start
+        await executor.tell(f'Win chance as landlord: {p:.0%} (estimated in {elapsed * 1000:.0f}ms)')
+
+    @commands.command('tournament', args=(('swiss|round_robin', str), ('rounds', int), ('table_size', int)),
+                      varargs='players', help='start a tournament, all normal players by default',
+                      checks=(check_admin, check_no_tournament))
+    async def cmd_tournament(self, executor: Player, fmt: str, rounds: int, table_size: int, roster: list[str]):
+        if any(room.busy() for room in self.rooms):
+            raise Exception('A game is running.')
+        if len(roster) == 0:
+            roster = [p.name for p in self.players if not p.always_spectator]
+        self.tournament = DdzTournament(fmt, roster, rounds, table_size,
+                                        self.tournament_state_path)
+        self.absent_since = {}
+        self.tournament.save()
+        await self.broadcast(f'Tournament ({fmt}, {rounds} rounds) started! Players: {",".join(roster)}.')
+        await self.tournament_advance()
+
+    @commands.command('standings', help='show the standings of the tournament', checks=(check_tournament,))
+    async def cmd_standings(self, executor: Player):
+        await executor.tell(self.standings_text())
+
+    @commands.command('tournament_stop', help='stop the tournament', checks=(check_admin, check_tournament))
+    async def cmd_tournament_stop(self, executor: Player):
+        msg = self.standings_text()
+        self.tournament = None
+        if self.tournament_state_path is not None:
+            os.remove(self.tournament_state_path)
+        for room in self.rooms[:]:
+            await self.cleanup(room)
+        await self.broadcast(f'Tournament stopped by {executor.name}.\n{msg}')
+
+    @commands.command('watch', varargs='player', help='watch the game of a player, or go back to the lobby')
+    async def cmd_watch(self, executor: Player, names: list[str]):
+        if not executor.player_type.startswith('spectator'):
+            raise Exception('You are playing.')
+        if len(names) > 1:
+            raise Exception(f'Usage: {self.commands.get("watch").usage()}')
+        room = self.lobby
+        if len(names) != 0:
+            targets = [p for p in self.players if p.name == names[0]]
+            if len(targets) == 0:
+                raise Exception(f'No player named {names[0]}.')
+            room = targets[0].room
+        self.move_player(executor, room)
+        await executor.send(self.clock_msg(room))
+        if room is self.lobby:
+            await executor.tell('You are back in the lobby.')
+        else:
+            await executor.tell(f'You are watching {room.name}.')
+
+    @commands.command('latency', varargs='players', help='show latency of the server and the players',
+                      checks=(check_admin,))
+    async def cmd_latency(self, executor: Player, names: list[str]):
+        lines = [f'server handle: {self.handle_stats.describe()}',
+                 f'server broadcast: {self.broadcast_stats.describe()}',
+                 f'server rtt: {self.rtt_stats.describe()}',
+                 f'server render: {self.render_stats.describe()}']
+        for p in self.players:
+            if len(names) != 0 and p.name not in names:
+                continue
+            lines.append(f'{p.name} handle: {p.handle_stats.describe()}')
+            lines.append(f'{p.name} rtt: {p.rtt_stats.describe()}')
+            lines.append(f'{p.name} render: {p.render_stats.describe()}')
+        await executor.tell('\n'.join(lines))
+
+    @commands.command('stats', help='show call counts and latency of every command and message handler',
+                      checks=(check_admin,))
+    async def cmd_stats(self, executor: Player):
+        lines = []
+        for kind, stats in (('message', self.message_stats), ('command', self.command_stats)):
+            for name, s in stats.items():
+                lines.append(f'{kind} {name}: {s.describe()}')
+        await executor.tell('\n'.join(lines))
+
+    @commands.command('help', varargs='commands', help='show this help, or the usage of some commands')
+    async def cmd_help(self, executor: Player, names: list[str]):
+        if len(names) != 0:
+            lines = []
+            for name in names:
+                command = self.commands.get(name)
+                if command is None:
+                    raise Exception(f'unknown command: {name}')
+                lines.append(f'{command.usage()}\n    {command.help}')
+            await executor.tell('\n'.join(lines))
+            return
+
+        names = [f'/{name}' for name in self.commands.names()]
+        lines = ['Avaliable Commands:']
+        for i in range(0, len(names), 8):
+            lines.append(', '.join(names[i:i + 8]))
+        lines.append('Note:')
+        for name in self.commands.names():
+            command = self.commands.get(name)
+            if len(command.args) != 0 or command.varargs is not None:
+                lines.append(f'    {command.usage()}')
+        lines.append('Use `/help <command>\' for details.')
+        await executor.tell('\n'.join(lines))
+
+    async def check_rate_limit(self, player: Player, bucket: TokenBucket, what: str,
+                               cost: float = 1.0) -> bool:
+        muted_for = bucket.muted_for()
+        if muted_for > 0:
+            await player.error(f'You are muted for {muted_for:.0f} more seconds.')
+            return False
+        if bucket.consume(cost):
+            return True
+        if self.rate_limit_policy == 'mute':
+            bucket.mute(self.mute_seconds)
+            await player.error(f'Too many {what}, you are muted for {self.mute_seconds:.0f} seconds.')
+        else:
+            await player.error(f'Too many {what}, message dropped.')
+        return False
+
+    def save_snapshot(self):
+        games = [game for game in (room.snapshot() for room in self.rooms) if game is not None]
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'games': games}, f)
+        os.replace(tmp_path, self.snapshot_path)
+
+    def handoff_expected(self) -> bool:
+        # a draining server marks the snapshot path until it has written the
+        # snapshot, no game may start here before its games are taken over
+        if self.snapshot_path is None or self.draining:
+            return False
+        if os.path.exists(self.snapshot_path):
+            return True
+        try:
+            with open(self.snapshot_path + '.draining') as f:
+                return time.time() < json.load(f)['until']
+        except (OSError, ValueError, KeyError):
+            return False
+
+    async def take_over(self):
+        # the previous server leaves a snapshot right before it asks its
+        # clients to reconnect
+        if any(room.busy() for room in self.rooms):
+            return
+        # several servers may be watching the same path, only one gets it
+        claimed = f'{self.snapshot_path}.{os.getpid()}'
+        try:
+            os.rename(self.snapshot_path, claimed)
+        except FileNotFoundError:
+            return
+        with open(claimed) as f:
+            snapshot = json.load(f)
+        os.remove(claimed)
+
+        games = snapshot.get('games')
+        if games is None:
+            # older servers hand over a single game
+            games = [] if snapshot.get('game') is None else [snapshot['game']]
+        if self.tournament_state_path is not None and os.path.exists(self.tournament_state_path):
+            tournament = DdzTournament.load(self.tournament_state_path,
+                                            resumed = [game['table'] for game in games
+                                                       if game.get('table') is not None])
+            self.tournament = None if tournament.finished() else tournament
+        if len(games) == 0:
+            return
+
+        for game in games:
+            room = self.lobby if game.get('table') is None else self.open_room(game['table'])
+            room.restoring = game
+
+        def expire():
+            self.spawn(self.restore_expired())
+
+        self.restore_timer = self.timers.schedule(self.restore_timeout, expire)
+        # players may have come here while the previous server drained
+        for p in list(self.players):
+            await self.seat_player(p)
+        for room in self.rooms[:]:
+            await self.resume_game(room)
+
+    async def restore_expired(self):
+        self.restore_timer = None
+        online = {p.name for p in self.players}
+        for room in self.rooms[:]:
+            if room.restoring is None:
+                continue
+            missing = [name for name in room.restoring['players'] if name not in online]
+            await self.broadcast(f'{",".join(missing)} didn\'t come back, the resumed game is aborted.')
+            if self.tournament is not None and room.table is not None:
+                self.tournament.abort(room.table)
+            await self.cleanup(room)
+        await self.tournament_advance()
+
+    async def watch_snapshot(self):
+        # pick the snapshot up as soon as it is written, rather than when
+        # somebody happens to join
+        expected = self.handoff_expected()
+        while True:
+            await asyncio.sleep(0.5)
+            if self.draining:
+                continue
+            await self.take_over()
+            # games held back while waiting for the handoff can go on now
+            if expected and not self.handoff_expected():
+                await self.tournament_advance()
+            expected = self.handoff_expected()
+
+    async def seat_player(self, player: Player) -> Union[None, DdzRoom]:
+        for room in self.rooms:
+            if room.restoring is None or player.name not in room.restoring['seats']:
+                continue
+            seat = room.restoring['seats'][player.name]
+            self.move_player(player, room)
+            player.player_type = seat['player_type']
+            player.set_cards(seat['cards'])
+            await player.sync_data(['player_type', 'cards'])
+            return room
+        return None
+
+    async def restore_seat(self, player: Player):
+        room = await self.seat_player(player)
+        if room is not None:
+            await self.resume_game(room)
+
+    async def resume_game(self, room: DdzRoom):
+        if room.restoring is None:
+            return
+
+        online = {p.name: p for p in self.players}
+        if not all(name in online for name in room.restoring['players']):
+            return
+
+        players = [online[name] for name in room.restoring['players']]
+        if room.restoring['status'] == 'wait_for_landlord':
+            room.status = DdzStatusWaitForLandlord(players, room.restoring['landlord_cards'],
+                                                   room.restoring.get('suit', 1))
+        else:
+            room.status = DdzStatusStarted(room.restoring['current_K'], players)
+            room.status.idx = room.restoring['idx']
+            room.status.played_stack = [(online[name], cards) for name, cards in room.restoring['played_stack']]
+        room.restoring = None
+        if self.restore_timer is not None and not any(r.restoring is not None for r in self.rooms):
+            self.timers.cancel(self.restore_timer)
+            self.restore_timer = None
+
+        await self.broadcast(f'Game resumed! Players: {",".join(sorted(p.name for p in players))}.',
+                             room.members)
+
+        if isinstance(room.status, DdzStatusWaitForLandlord):
+            await self.arm_clock(room, 'bid', None, self.bid_time)
+        else:
+            await self.arm_clock(room, 'turn', room.status.front(), self.turn_time)
 
-    def get_playing_players(self) -> list[Player]:
-        res = []
+    async def drain(self):
+        if self.draining:
+            return
+        self.draining = True
+
+        # stop accepting connections, so that the next server can take over the port
+        self.server.close()
+
+        if self.snapshot_path is not None:
+            # tell the next server to wait for our snapshot; it's written at the
+            # latest when the drain times out, give it a few seconds more
+            with open(self.snapshot_path + '.draining', 'w') as f:
+                json.dump({'until': time.time() + self.drain_timeout + 5.0}, f)
+
+        await self.broadcast('Server is going to restart, no new games can be started.')
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.drain_timeout
+        while any(room.status is not None for room in self.rooms) and loop.time() < deadline:
+            await asyncio.sleep(0.5)
+
+        # ratings are written through dbm as soon as a game ends, and the
+        # tournament saves itself after every change, so only the games are
+        # left; they go on on the next server, with new clocks
+        for room in self.rooms:
+            self.disarm_clock(room)
+
+        if self.snapshot_path is not None:
+            self.save_snapshot()
+            os.remove(self.snapshot_path + '.draining')
+        elif any(room.status is not None for room in self.rooms):
+            await self.broadcast('The running games are aborted.')
+
+        await self.send_all(json.dumps({'type': 'reconnect'}))
         for p in self.players:
-            if not p.name.startswith('spectator'):
-                res.append(p)
-        return res
+            p.writer.close()
+        self.stopped.set()
 
-    def update_rating(self, landlord_wins: bool) -> list[tuple[str, float, float]]:
-        players = self.get_playing_players()
+    def update_rating(self, room: DdzRoom, landlord_wins: bool) -> list[tuple[str, float, float]]:
+        players = room.members
 
         landlord = list(filter(lambda p: p.player_type.startswith('landlord'), players))
         peasants = list(filter(lambda p: p.player_type.startswith('peasant'), players))
@@ -256,26 +976,15 @@ Note:
         if len(peasants) == 0:
             raise Exception('no farmers, cannot calculate rating')
 
-        landlord_delta = 0.0
-        peasants_delta: list[float] = []
-
         info: list[tuple[str, float, float]] = []
 
         with dbm.open(self.rating_db_path, 'c') as db:
             landlord_rating = get_rating(db, landlord[0].name)
             peasants_rating = list(map(lambda p: get_rating(db, p.name), peasants))
 
-            for p in peasants_rating:
-                diff = (p - landlord_rating) / 400
-                if abs(diff) < 100:
-                    exp = 1 / (1 + 10**(diff))
-                else:
-                    exp = diff < 0
-
-                delta = self.status.current_K * (landlord_wins - exp)
-
-                landlord_delta += delta
-                peasants_delta.append(-delta)
+            deltas = rating_deltas(room.status.current_K, landlord_rating, peasants_rating, landlord_wins)
+            landlord_delta = sum(deltas)
+            peasants_delta = [-d for d in deltas]
 
             set_rating(db, landlord[0].name, landlord_rating + landlord_delta)
             info.append((landlord[0].name, landlord_delta, landlord_rating + landlord_delta))
@@ -286,20 +995,122 @@ Note:
         info.sort(key = lambda d: -d[1])
         return info
 
+    async def handle_message(self, player: Player, body: dict):
+        handler = self.messages.get(body.get('type'))
+        if handler is not None:
+            await handler.call(self.message_stats[handler.name], self, player, body)
+
+    @messages.message('chat')
+    async def msg_chat(self, player: Player, body: dict):
+        if not await self.check_rate_limit(player, player.chat_bucket, 'chat messages'):
+            return
+        chat = {
+                'type': 'chat',
+                'author': player.name,
+                'player_type': body['player_type'],
+                'content': body['content']}
+        self.chat_history.append(chat)
+        await self.send_all(json.dumps(chat))
+
+    @messages.message('play')
+    async def msg_play(self, player: Player, body: dict):
+        if player.player_type.startswith('spectator'):
+            return
+
+        room = player.room
+        if not isinstance(room.status, DdzStatusStarted):
+            await player.tell('Game isn\'t started')
+            return
+
+        if room.status.front() != player:
+            await player.tell(f'Not your turn! (expect {room.status.front().name})')
+            return
+
+        cards = list(body['cards'])
+        if not player.check_have_cards(cards):
+            await player.tell('You don\'t have these cards')
+            return
+        await self.play_cards(room, player, cards)
+
+    async def play_cards(self, room: DdzRoom, player: Player, cards: list[str]):
+        self.disarm_clock(room)
+        player.remove_cards(cards)
+
+        room.status.shift(1)
+
+        room.status.played_stack.append((player, cards))
+        await player.sync_data(['cards'])
+
+        await self.send_all(json.dumps({
+            'type': 'play',
+            'player': player.name,
+            'player_type': player.player_type,
+            'cards': ''.join(cards)}), room.members)
+
+        if is_bomb(cards):
+            room.status.incr_k()
+
+        if len(player.cards) == 0:
+            await self.finish_game(room, player.player_type.startswith('landlord'))
+        else:
+            await self.arm_clock(room, 'turn', room.status.front(), self.turn_time)
+
+    async def finish_game(self, room: DdzRoom, landlord_wins: bool):
+        try:
+            delta = self.update_rating(room, landlord_wins)
+            await self.send_all(json.dumps({
+                'type': 'rating_update',
+                'k': room.status.current_K,
+                'delta': list(map(
+                    lambda d: {'name': d[0],
+                               'delta': d[1],
+                               'rating': d[2]}, delta))}), room.members)
+            if self.tournament is not None and room.table is not None:
+                self.tournament.record(
+                        room.status.player_ord[0].name,
+                        [p.name for p in room.status.player_ord[1:]],
+                        landlord_wins)
+            await self.cleanup(room)
+            await self.tournament_advance()
+        except Exception as e:
+            print(e)
+            await self.send_all(json.dumps({
+                'type': 'error',
+                'what': str(e)}), room.members)
+
+    @messages.message('cmd')
+    async def msg_cmd(self, player: Player, body: dict):
+        try:
+            await self.exec_command(player, body['cmd'])
+        except Exception as e:
+            print(e)
+            await player.error(str(e))
+
+    @messages.message('latency_report')
+    async def msg_latency_report(self, player: Player, body: dict):
+        # don't let a client flood the stats with a single report
+        for t in latency_samples(body.get('rtt')):
+            player.rtt_stats.add(t)
+            self.rtt_stats.add(t)
+        for t in latency_samples(body.get('render')):
+            player.render_stats.add(t)
+            self.render_stats.add(t)
+
     async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
 
-        async def read_join_name() -> str:
-            length = int.from_bytes(await reader.readexactly(4), byteorder = 'big')
-            body = json.loads(await reader.readexactly(length))
-            if body['type'] != 'join':
+        async def read_join() -> dict:
+            body = await read_msg(reader)
+            if body.get('type') != 'join':
                 raise Exception('wrong message type')
-            name = body['name']
-            if any((name == p.name for p in self.players)):
+            if not isinstance(body.get('name'), str) or body['name'] == '':
+                raise Exception('bad player name')
+            if any((body['name'] == p.name for p in self.players)):
                 raise Exception('player is already in the server')
-            return name
+            return body
 
         try:
-            name = await read_join_name()
+            join = await read_join()
+            name = join['name']
         except Exception as e:
             print(e)
             writer.close()
@@ -308,106 +1119,125 @@ Note:
 
         await self.broadcast(f'{name} joined the game')
 
-        player = Player(writer, name)
+        compressor = None
+        if 'zlib' in join.get('compress', []):
+            compressor = zlib.compressobj()
+
+        player = Player(writer, name,
+                        TokenBucket(self.chat_rate, self.chat_burst),
+                        TokenBucket(self.cmd_rate, self.cmd_burst),
+                        compressor, self.compress_threshold)
         self.players.append(player)
+        self.move_player(player, self.lobby)
+
+        player.commands = [f'/{name}' for name in self.commands.names()]
+        await player.sync_data(['commands'])
+
+        if len(self.chat_history) != 0:
+            await player.send(json.dumps({
+                'type': 'chat_history',
+                'messages': list(self.chat_history)}))
+
+        if self.lobby.clock is not None:
+            await player.send(self.clock_msg(self.lobby))
+
+        await self.restore_seat(player)
+        await self.tournament_advance()
 
         while True:
             try:
-                length = int.from_bytes(await reader.readexactly(4), byteorder = 'big')
-                body = json.loads(await reader.readexactly(length))
+                body = await read_msg(reader)
             except Exception:
                 break
 
-            if body['type'] == 'chat':
-                await self.send_all(json.dumps({
-                    'type': 'chat',
-                    'author': name,
-                    'player_type': body['player_type'],
-                    'content': body['content']}))
-            elif body['type'] == 'play':
-                if player.player_type.startswith('spectator'):
-                    continue
-
-                if not isinstance(self.status, DdzStatusStarted):
-                    await player.tell('Game isn\'t started')
-                    continue
-
-                if self.status.front() != player:
-                    await player.tell(f'Not your turn! (expect {self.status.front().name})')
-                    continue
-
-                cards = list(body['cards'])
-                if not player.check_have_cards(cards):
-                    await player.tell('You don\'t have these cards')
-                    continue
-                player.remove_cards(cards)
-
-                self.status.shift(1)
-
-                self.status.played_stack.append((player, cards))
-                await player.sync_data(['cards'])
-
-                await self.send_all(json.dumps({
-                    'type': 'play',
-                    'player': name,
-                    'player_type': body['player_type'],
-                    'cards': ''.join(cards)}))
-
-                if is_bomb(cards):
-                    self.status.incr_k()
-
-                if len(player.cards) == 0:
-                    try:
-                        delta = self.update_rating(player.player_type.startswith('landlord'))
-                        await self.send_all(json.dumps({
-                            'type': 'rating_update',
-                            'k': self.status.current_K,
-                            'delta': list(map(
-                                lambda d: {'name': d[0],
-                                           'delta': d[1],
-                                           'rating': d[2]}, delta))}))
-                        await self.cleanup()
-                    except Exception as e:
-                        print(e)
-                        await self.send_all(json.dumps({
-                            'type': 'error',
-                            'what': str(e)}))
-            elif body['type'] == 'cmd':
-                try:
-                    await self.exec_command(player, body['cmd'])
-                except Exception as e:
-                    print(e)
-                    await player.send(json.dumps({
-                        'type': 'error',
-                        'what': str(e)}))
+            recv_ts = time.time()
+            start = time.perf_counter()
+            try:
+                await self.handle_message(player, body)
+            except Exception as e:
+                # a malformed message must not take the connection down and
+                # leave the player behind in self.players
+                print(e)
+                await player.error(str(e))
+            elapsed = time.perf_counter() - start
+            player.handle_stats.add(elapsed)
+            self.handle_stats.add(elapsed)
+
+            if isinstance(body, dict) and 'id' in body:
+                await player.send(json.dumps({
+                    'type': 'ack',
+                    'id': body['id'],
+                    'ts': recv_ts,
+                    'handle': elapsed}))
 
         self.players.remove(player)
+        room = player.room
+        room.members.remove(player)
+
+        if self.draining:
+            # the game goes to the next server, leave it alone
+            player.writer.close()
+            return
 
         # if the player is in the game, then the game should end?
         if not player.player_type.startswith('spectator'):
-            await self.cleanup()
+            if self.tournament is not None and room.table is not None:
+                self.tournament.abort(room.table)
+            await self.cleanup(room)
 
         await self.broadcast(f'{name} exited.')
+        await self.tournament_advance()
         player.writer.close()
         await player.writer.wait_closed()
 
-    async def broadcast(self, msg: str):
-        await self.send_all(json.dumps({'type': 'tell', 'content': msg}))
+    async def broadcast(self, msg: str, players: Union[None, list[Player]] = None):
+        await self.send_all(json.dumps({'type': 'tell', 'content': msg}), players)
 
-    async def send_all(self, msg: str):
-        bmsg = encode_msg(msg)
-        for p in self.players:
-            p.writer.write(bmsg)
-        await asyncio.gather(*(p.writer.drain() for p in self.players))
+    async def send_all(self, msg: str, players: Union[None, list[Player]] = None):
+        # everyone in the server by default, or the members of a room
+        if players is None:
+            players = self.players
+        start = time.perf_counter()
+        bmsg = msg.encode()
+        frame = encode_frame(bmsg)
+        for p in players:
+            if p.compressor is not None and len(bmsg) >= p.compress_threshold:
+                # every connection has its own zlib stream
+                p.writer.write(encode_frame(bmsg, p.compressor, p.compress_threshold))
+            else:
+                p.writer.write(frame)
+        await asyncio.gather(*(p.writer.drain() for p in players))
+        self.broadcast_stats.add(time.perf_counter() - start)
 
     async def run(self):
-        self.server = await asyncio.start_server(self.handle, self.addr, self.port)
+        self.stopped = asyncio.Event()
+        timers_task = asyncio.create_task(self.timers.run())
+        if landlord_odds is not None:
+            # numpy sets itself up on the first call, don't let the first
+            # /odds pay for it
+            landlord_odds(list(suit_cards[:17]), 3, 1, samples = 16)
+        watch_task = None
+        if self.snapshot_path is not None:
+            await self.take_over()
+            watch_task = asyncio.create_task(self.watch_snapshot())
+        self.server = await asyncio.start_server(self.handle, self.addr, self.port,
+                                                 reuse_port = self.reuse_port or None)
 
         addrs = ', '.join(str(sock.getsockname()) for sock in self.server.sockets)
         print(f'Serving on {addrs}')
 
+        try:
+            asyncio.get_running_loop().add_signal_handler(
+                    signal.SIGTERM, lambda: self.spawn(self.drain()))
+        except (NotImplementedError, AttributeError):
+            # no SIGTERM handling on Windows
+            pass
+
         async with self.server:
-            await self.server.serve_forever()
+            await self.stopped.wait()
+        timers_task.cancel()
+        if watch_task is not None:
+            watch_task.cancel()
 
 
 if __name__ == '__main__':
@@ -416,7 +1246,50 @@ if __name__ == '__main__':
     parser.add_argument('addr', help='bind to this address')
     parser.add_argument('port', help='bind to this port', type=int)
     parser.add_argument('rating_db_path', help='path of rating database')
+    parser.add_argument('--chat-rate', help='chat messages per second allowed for each player', type=float, default=1.0)
+    parser.add_argument('--chat-burst', help='chat messages a player can send in a burst', type=float, default=5.0)
+    parser.add_argument('--cmd-rate', help='commands per second allowed for each player', type=float, default=2.0)
+    parser.add_argument('--cmd-burst', help='commands a player can send in a burst', type=float, default=10.0)
+    parser.add_argument('--rate-limit-policy', help='drop the message or mute the player when the limit is exceeded',
+                        choices=['drop', 'mute'], default='drop')
+    parser.add_argument('--mute-seconds', help='how long a player is muted by the mute policy', type=float, default=30.0)
+    parser.add_argument('--chat-history', help='number of recent chat messages sent to new players', type=int, default=50)
+    parser.add_argument('--tournament-state', help='file to save tournament progress to, resumed on restart')
+    parser.add_argument('--absent-grace', help='seconds a tournament table waits for an absent player before they '
+                        'forfeit and leave the tournament, 0 to wait forever', type=float, default=120.0)
+    parser.add_argument('--snapshot', help='file to hand the running game over to the next server on SIGTERM')
+    parser.add_argument('--drain-timeout', help='seconds to wait for the running game to finish on SIGTERM before '
+                        'snapshotting it', type=float, default=300.0)
+    parser.add_argument('--restore-timeout', help='seconds to wait for the players of a game taken over from the '
+                        'previous server before aborting it', type=float, default=60.0)
+    parser.add_argument('--compress-threshold', help='messages shorter than this many bytes are never compressed',
+                        type=int, default=256)
+    parser.add_argument('--admin', help='player allowed to run admin commands, can be given many times, '
+                        'everyone is an admin if not given', action='append', default=[])
+    parser.add_argument('--turn-time', help='seconds a player has to play, 0 for no limit', type=float, default=0.0)
+    parser.add_argument('--bid-time', help='seconds to wait for someone to become landlord, 0 for no limit',
+                        type=float, default=0.0)
+    parser.add_argument('--timeout-action', help='what happens when time is up: pass the turn or deal again, '
+                        'or forfeit the game', choices=['pass', 'forfeit'], default='pass')
+    parser.add_argument('--reuse-port', help='allow the next server to listen on the same port while this one drains',
+                        action='store_true')
 
     args = parser.parse_args()
-    server = DdzServer(args.addr, args.port, args.rating_db_path)
+    server = DdzServer(args.addr, args.port, args.rating_db_path,
+                       chat_rate=args.chat_rate, chat_burst=args.chat_burst,
+                       cmd_rate=args.cmd_rate, cmd_burst=args.cmd_burst,
+                       rate_limit_policy=args.rate_limit_policy,
+                       mute_seconds=args.mute_seconds,
+                       chat_history=args.chat_history,
+                       tournament_state_path=args.tournament_state,
+                       absent_grace=args.absent_grace,
+                       snapshot_path=args.snapshot,
+                       drain_timeout=args.drain_timeout,
+                       restore_timeout=args.restore_timeout,
+                       reuse_port=args.reuse_port,
+                       compress_threshold=args.compress_threshold,
+                       admins=args.admin,
+                       turn_time=args.turn_time,
+                       bid_time=args.bid_time,
+                       timeout_action=args.timeout_action)
     asyncio.run(server.run())
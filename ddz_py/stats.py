@@ -0,0 +1,22 @@
+from collections import deque
+
+
+class LatencyStats:
+    def __init__(self, size: int = 1024):
+        # only the most recent samples are kept, in seconds
+        self.samples: deque[float] = deque(maxlen=size)
+        self.count = 0
+
+    def add(self, seconds: float):
+        self.samples.append(seconds)
+        self.count += 1
+
+    def describe(self) -> str:
+        if len(self.samples) == 0:
+            return 'n=0'
+        ordered = sorted(self.samples)
+
+        def ms(q: float) -> str:
+            return f'{ordered[int(q * (len(ordered) - 1))] * 1000:.1f}'
+
+        return f'n={self.count} p50={ms(0.5)}ms p90={ms(0.9)}ms p99={ms(0.99)}ms max={ms(1)}ms'
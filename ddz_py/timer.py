@@ -0,0 +1,84 @@
+import asyncio
+import math
+
+from typing import Callable, Union
+
+
+class DdzTimer:
+    __slots__ = ('expires', 'callback', 'bucket')
+
+    def __init__(self, expires: int, callback: Callable[[], None]):
+        self.expires = expires
+        self.callback = callback
+        self.bucket: Union[None, set] = None
+
+
+class DdzTimerWheel:
+    # Hierarchical timing wheel: level 0 has one slot per tick, every slot of
+    # level n covers a whole revolution of level n - 1. Timers are put into
+    # the lowest level that can hold them and moved down as time goes by, so
+    # both arming and cancelling are O(1) whatever the number of timers.
+    def __init__(self, tick: float = 0.1, bits: int = 6, levels: int = 4):
+        self.tick = tick
+        self.bits = bits
+        self.mask = (1 << bits) - 1
+        self.levels = levels
+        self.wheels: list[list[set]] = [[set() for i in range(1 << bits)] for j in range(levels)]
+        # ticks elapsed since the wheel started
+        self.now = 0
+
+    def place(self, timer: DdzTimer):
+        diff = timer.expires - self.now
+        level = 0
+        while level < self.levels - 1 and diff >= 1 << (self.bits * (level + 1)):
+            level += 1
+        # timers beyond the top level wait there and get placed again when
+        # their slot comes round
+        bucket = self.wheels[level][(timer.expires >> (self.bits * level)) & self.mask]
+        bucket.add(timer)
+        timer.bucket = bucket
+
+    def schedule(self, delay: float, callback: Callable[[], None]) -> DdzTimer:
+        timer = DdzTimer(self.now + max(1, math.ceil(delay / self.tick)), callback)
+        self.place(timer)
+        return timer
+
+    def cancel(self, timer: DdzTimer):
+        if timer.bucket is not None:
+            timer.bucket.discard(timer)
+            timer.bucket = None
+
+    def remaining(self, timer: DdzTimer) -> float:
+        return max(0, timer.expires - self.now) * self.tick
+
+    def advance(self):
+        self.now += 1
+
+        # move timers down from the levels that just finished a revolution
+        level = 1
+        while level < self.levels and self.now & ((1 << (self.bits * level)) - 1) == 0:
+            bucket = self.wheels[level][(self.now >> (self.bits * level)) & self.mask]
+            timers = list(bucket)
+            bucket.clear()
+            for timer in timers:
+                self.place(timer)
+            level += 1
+
+        bucket = self.wheels[0][self.now & self.mask]
+        timers = list(bucket)
+        bucket.clear()
+        for timer in timers:
+            if timer.expires <= self.now:
+                timer.bucket = None
+                timer.callback()
+            else:
+                self.place(timer)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        while True:
+            await asyncio.sleep(max(0.0, start + (self.now + 1) * self.tick - loop.time()))
+            # catch up if the event loop was too busy to wake us up in time
+            while self.now < (loop.time() - start) / self.tick:
+                self.advance()
@@ -0,0 +1,212 @@
+import json
+import os
+import random
+
+from collections import Counter
+from typing import Union
+
+
+# table size -> (cards_each, suit), same as `/start' and `/start4'
+TABLE_CONFIGS = {
+        3: (17, 1),
+        4: (25, 2),
+        }
+
+# round robin seatings tried every round, the one with the fewest rematches
+# is played
+ROUND_ROBIN_TRIES = 20
+
+
+class DdzTournament:
+    def __init__(self, fmt: str, roster: list[str], rounds: int, table_size: int,
+                 state_path: Union[None, str] = None):
+        if fmt not in ('swiss', 'round_robin'):
+            raise Exception(f'unknown tournament format: {fmt}')
+        if table_size not in TABLE_CONFIGS:
+            raise Exception(f'table size should be one of {", ".join(map(str, TABLE_CONFIGS))}')
+        if len(set(roster)) != len(roster):
+            raise Exception('duplicated players in roster')
+        if len(roster) < table_size:
+            raise Exception('No enough players.')
+        if rounds <= 0:
+            raise Exception('There should be at least 1 round.')
+
+        self.fmt = fmt
+        self.roster = roster
+        self.rounds = rounds
+        self.table_size = table_size
+        self.state_path = state_path
+
+        self.round = 0
+        self.standings = {name: {'points': 0, 'wins': 0, 'games': 0, 'byes': 0} for name in roster}
+        self.pending: list[list[str]] = []
+        # tables dealt and not finished yet, all of them play at once
+        self.playing: list[list[str]] = []
+        # everyone a player has sat at a table with, once per game
+        self.opponents: dict[str, list[str]] = {name: [] for name in roster}
+        # players who didn't show up and are not paired any more
+        self.withdrawn: list[str] = []
+
+    def to_dict(self) -> dict:
+        return {
+                'format': self.fmt,
+                'roster': self.roster,
+                'rounds': self.rounds,
+                'table_size': self.table_size,
+                'round': self.round,
+                'standings': self.standings,
+                'pending': self.pending,
+                'playing': self.playing,
+                'opponents': self.opponents,
+                'withdrawn': self.withdrawn,
+                }
+
+    @classmethod
+    def from_dict(cls, d: dict, state_path: Union[None, str] = None) -> 'DdzTournament':
+        t = cls(d['format'], d['roster'], d['rounds'], d['table_size'], state_path)
+        t.round = d['round']
+        t.standings = d['standings']
+        t.pending = d['pending']
+        # state files of older versions had a single table in play
+        t.playing = d.get('playing', [] if d.get('current') is None else [d['current']])
+        t.opponents = d.get('opponents', t.opponents)
+        t.withdrawn = d.get('withdrawn', [])
+        return t
+
+    @classmethod
+    def load(cls, state_path: str, resumed: Union[None, list[list[str]]] = None) -> 'DdzTournament':
+        with open(state_path) as f:
+            t = cls.from_dict(json.load(f), state_path)
+        # the games in progress were lost with the previous server, replay
+        # them, except for those it handed over
+        for table in t.playing[:]:
+            if resumed is None or table not in resumed:
+                t.playing.remove(table)
+                t.pending.insert(0, table)
+        return t
+
+    def save(self):
+        if self.state_path is None:
+            return
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp_path, self.state_path)
+
+    def active(self) -> list[str]:
+        return [name for name in self.roster if name not in self.withdrawn]
+
+    def finished(self) -> bool:
+        if len(self.pending) != 0 or len(self.playing) != 0:
+            return False
+        return self.round >= self.rounds or len(self.active()) < self.table_size
+
+    def seat_tables(self, order: list[str], met: dict[str, Counter]) -> list[list[str]]:
+        # fill every table from the front of the order, taking for each seat
+        # the next player in the order who hasn't met anyone at the table yet,
+        # or who met them the fewest times
+        rest = order[:]
+        tables = []
+        while len(rest) >= self.table_size:
+            table = [rest.pop(0)]
+            while len(table) < self.table_size:
+                best, best_cost = 0, None
+                for i, name in enumerate(rest):
+                    cost = sum(met[name][other] for other in table)
+                    if best_cost is None or cost < best_cost:
+                        best, best_cost = i, cost
+                        if cost == 0:
+                            break
+                table.append(rest.pop(best))
+            tables.append(table)
+        return tables
+
+    @staticmethod
+    def rematches(tables: list[list[str]], met: dict[str, Counter]) -> int:
+        return sum(met[a][b] for table in tables for i, a in enumerate(table) for b in table[i + 1:])
+
+    def ranking(self) -> list[tuple[str, dict]]:
+        return sorted(self.standings.items(),
+                      key = lambda s: (-s[1]['points'], -s[1]['wins'], s[0]))
+
+    def pair_round(self):
+        self.round += 1
+
+        order = self.active()
+        random.shuffle(order)
+        if self.fmt == 'swiss':
+            order.sort(key = lambda n: -self.standings[n]['points'])
+
+        # a bye scores nothing, so it goes to whoever had the fewest, and in
+        # swiss to the lowest ranked of them
+        bye_cnt = len(order) % self.table_size
+        byes = sorted(reversed(order), key = lambda n: self.standings[n]['byes'])[:bye_cnt]
+        for name in byes:
+            self.standings[name]['byes'] += 1
+        seated = [name for name in order if name not in byes]
+
+        met = {name: Counter(self.opponents[name]) for name in seated}
+        if self.fmt == 'swiss':
+            # players with close scores sit together
+            self.pending = self.seat_tables(seated, met)
+        else:
+            # no order to keep, try a few and play the one with the fewest
+            # rematches
+            self.pending = min((self.seat_tables(random.sample(seated, len(seated)), met)
+                                for i in range(ROUND_ROBIN_TRIES)),
+                               key = lambda tables: self.rematches(tables, met))
+
+    def next_tables(self, online: set[str]) -> list[list[str]]:
+        # every table of the round whose players are all there, a new round
+        # is paired once all tables of the last one have finished
+        if len(self.pending) == 0 and len(self.playing) == 0:
+            if self.finished():
+                return []
+            self.pair_round()
+        tables = [table for table in self.pending if all(name in online for name in table)]
+        for table in tables:
+            self.pending.remove(table)
+            self.playing.append(table)
+        self.save()
+        return tables
+
+    def absent(self, online: set[str]) -> list[str]:
+        # players the pending tables are waiting for
+        return [name for table in self.pending for name in table if name not in online]
+
+    def withdraw(self, names: list[str]):
+        # absent players lose the games they were paired for and are left out
+        # of later rounds, the others at their tables get a bye
+        for name in names:
+            if name not in self.withdrawn:
+                self.withdrawn.append(name)
+        for table in self.pending[:]:
+            if not any(name in names for name in table):
+                continue
+            self.pending.remove(table)
+            for name in table:
+                if name in names:
+                    self.standings[name]['games'] += 1
+                else:
+                    self.standings[name]['byes'] += 1
+        self.save()
+
+    def record(self, landlord: str, peasants: list[str], landlord_wins: bool):
+        for name in [landlord] + peasants:
+            self.standings[name]['games'] += 1
+            self.opponents[name].extend(other for other in [landlord] + peasants if other != name)
+        if landlord_wins:
+            self.standings[landlord]['points'] += len(peasants)
+            self.standings[landlord]['wins'] += 1
+        else:
+            for name in peasants:
+                self.standings[name]['points'] += 1
+                self.standings[name]['wins'] += 1
+        self.playing = [table for table in self.playing if landlord not in table]
+        self.save()
+
+    def abort(self, table: list[str]):
+        if table in self.playing:
+            self.playing.remove(table)
+            self.pending.append(table)
+        self.save()
@@ -4,6 +4,7 @@ in pkgs.mkShell {
   packages = [
     (pkgs.python313.withPackages (python-pkgs: [
       python-pkgs.colorama
+      python-pkgs.numpy
       python-pkgs.prompt-toolkit
       python-pkgs.wcwidth
     ]))
@@ -0,0 +1,60 @@
+import os
+import subprocess
+import sys
+import unittest
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# TUI dependencies only the interactive clients need, and only once they run
+HEAVY_MODULES = ('prompt_toolkit', 'colorama', 'hashlib')
+
+# microseconds, the modules of ddz_py themselves take about 2ms altogether
+DDZ_PY_BUDGET = 20_000
+# microseconds, most of it is asyncio and argparse from the standard library
+TOTAL_BUDGET = 500_000
+
+RUNS = 3
+
+
+def import_times(module: str) -> dict[str, tuple[int, int]]:
+    # module -> (self, cumulative) import time in microseconds, as reported by
+    # a fresh interpreter
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                          cwd=ROOT, capture_output=True, text=True, check=True)
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+class ImportTimeTest(unittest.TestCase):
+    def check_module(self, module: str):
+        runs = [import_times(module) for i in range(RUNS)]
+
+        for name in runs[0]:
+            self.assertFalse(name.split('.')[0] in HEAVY_MODULES,
+                             f'importing {module} loads {name}')
+
+        # the fastest run is the least disturbed by the rest of the machine
+        own = min(sum(s for name, (s, c) in times.items() if name.split('.')[0] == 'ddz_py')
+                  for times in runs)
+        total = min(times[module][1] for times in runs)
+        self.assertLess(own, DDZ_PY_BUDGET, f'ddz_py modules took {own}us to import')
+        self.assertLess(total, TOTAL_BUDGET, f'{module} took {total}us to import')
+
+    def test_client(self):
+        self.check_module('ddz_py.client')
+
+    def test_client_script(self):
+        self.check_module('ddz_py.client_script')
+
+    def test_client_deluxe(self):
+        self.check_module('ddz_py.client_deluxe')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,179 @@
+import json
+import os
+import random
+import tempfile
+import unittest
+
+from collections import Counter
+
+from ddz_py.tournament import DdzTournament
+
+
+def play_rounds(t: DdzTournament, rounds: int, rng: random.Random):
+    for r in range(rounds):
+        t.pair_round()
+        for table in t.pending:
+            t.record(table[0], table[1:], rng.random() < 0.5)
+        t.pending = []
+
+
+def meetings(t: DdzTournament) -> Counter:
+    pairs = Counter()
+    for name in t.roster:
+        for other in t.opponents[name]:
+            if name < other:
+                pairs[(name, other)] += 1
+    return pairs
+
+
+class PairingTest(unittest.TestCase):
+    def setUp(self):
+        random.seed(0)
+        self.rng = random.Random(0)
+
+    def test_round_robin_meets_everyone_once(self):
+        # 9 players at tables of 3 can meet everyone exactly once in 4 rounds
+        t = DdzTournament('round_robin', [f'p{i}' for i in range(9)], 4, 3)
+        play_rounds(t, 4, self.rng)
+        pairs = meetings(t)
+        self.assertEqual(len(pairs), 9 * 8 // 2)
+        self.assertEqual(max(pairs.values()), 1)
+
+    def test_round_robin_spreads_meetings(self):
+        # 11 rounds of 3 opponents among 11 others is 3 meetings on average
+        t = DdzTournament('round_robin', [f'p{i:02}' for i in range(12)], 11, 4)
+        play_rounds(t, 11, self.rng)
+        pairs = meetings(t)
+        self.assertEqual(len(pairs), 12 * 11 // 2)
+        self.assertLessEqual(max(pairs.values()), 5)
+
+    def test_every_round_seats_everyone_once(self):
+        for fmt in ('swiss', 'round_robin'):
+            t = DdzTournament(fmt, [f'p{i:02}' for i in range(14)], 3, 4)
+            t.pair_round()
+            seated = [name for table in t.pending for name in table]
+            self.assertEqual(len(seated), len(set(seated)))
+            self.assertEqual(len(seated), 12)
+            self.assertTrue(all(len(table) == 4 for table in t.pending))
+
+    def test_byes_rotate(self):
+        for fmt in ('swiss', 'round_robin'):
+            t = DdzTournament(fmt, [f'p{i}' for i in range(7)], 6, 3)
+            play_rounds(t, 6, self.rng)
+            byes = [s['byes'] for s in t.standings.values()]
+            self.assertEqual(sum(byes), 6)
+            self.assertLessEqual(max(byes), 1, fmt)
+
+    def test_swiss_bye_goes_to_lowest_without_one(self):
+        t = DdzTournament('swiss', ['a', 'b', 'c', 'd'], 2, 3)
+        for points, name in enumerate(['d', 'c', 'b', 'a']):
+            t.standings[name]['points'] = points
+        t.standings['d']['byes'] = 1
+        t.pair_round()
+        self.assertEqual(t.standings['c']['byes'], 1)
+        self.assertEqual(t.pending, [['a', 'b', 'd']])
+
+    def test_swiss_avoids_rematches(self):
+        t = DdzTournament('swiss', [f'p{i}' for i in range(9)], 4, 3)
+        play_rounds(t, 4, self.rng)
+        self.assertEqual(max(meetings(t).values()), 1)
+
+
+class WithdrawTest(unittest.TestCase):
+    def test_absent_players_forfeit_and_leave(self):
+        t = DdzTournament('round_robin', [f'p{i}' for i in range(6)], 3, 3)
+        t.pair_round()
+        absent = t.pending[0][0]
+        others = t.pending[0][1:]
+        t.withdraw([absent])
+        self.assertEqual(len(t.pending), 1)
+        self.assertEqual(t.standings[absent]['games'], 1)
+        self.assertTrue(all(t.standings[name]['byes'] == 1 for name in others))
+
+        t.pending = []
+        t.pair_round()
+        self.assertNotIn(absent, [name for table in t.pending for name in table])
+
+    def test_too_few_players_left_finishes(self):
+        t = DdzTournament('swiss', ['a', 'b', 'c'], 3, 3)
+        self.assertFalse(t.finished())
+        t.withdraw(['a'])
+        self.assertTrue(t.finished())
+        self.assertEqual(t.next_tables({'b', 'c'}), [])
+
+
+class ConcurrentTablesTest(unittest.TestCase):
+    def setUp(self):
+        random.seed(0)
+
+    def test_all_ready_tables_play_at_once(self):
+        names = [f'p{i}' for i in range(9)]
+        t = DdzTournament('swiss', names, 2, 3)
+        tables = t.next_tables(set(names))
+        self.assertEqual(len(tables), 3)
+        self.assertEqual(t.playing, tables)
+        self.assertEqual(t.pending, [])
+
+        # the next round waits for every table of this one
+        t.record(tables[0][0], tables[0][1:], True)
+        self.assertEqual(t.next_tables(set(names)), [])
+        self.assertEqual(t.round, 1)
+        for table in tables[1:]:
+            t.record(table[0], table[1:], False)
+        self.assertEqual(len(t.next_tables(set(names))), 3)
+        self.assertEqual(t.round, 2)
+
+    def test_tables_wait_for_their_players(self):
+        names = [f'p{i}' for i in range(6)]
+        t = DdzTournament('round_robin', names, 1, 3)
+        t.pair_round()
+        late = t.pending[1][0]
+        tables = t.next_tables(set(names) - {late})
+        self.assertEqual(tables, t.playing)
+        self.assertEqual(len(tables), 1)
+        self.assertEqual(t.absent(set(names) - {late}), [late])
+
+        t.abort(tables[0])
+        self.assertEqual(t.playing, [])
+        self.assertEqual(len(t.next_tables(set(names))), 2)
+
+
+class StateTest(unittest.TestCase):
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'state.json')
+            t = DdzTournament('swiss', ['a', 'b', 'c', 'd'], 2, 3, path)
+            [table] = t.next_tables({'a', 'b', 'c', 'd'})
+            t.withdraw(['d'])
+
+            loaded = DdzTournament.load(path)
+            # the game in progress is played again
+            self.assertEqual(loaded.playing, [])
+            self.assertIn(table, loaded.pending)
+            self.assertEqual(loaded.withdrawn, ['d'])
+            self.assertEqual(loaded.standings, t.standings)
+
+            # unless the previous server handed it over
+            loaded = DdzTournament.load(path, resumed = [table])
+            self.assertEqual(loaded.playing, [table])
+            self.assertNotIn(table, loaded.pending)
+
+    def test_load_state_of_older_versions(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'state.json')
+            state = DdzTournament('swiss', ['a', 'b', 'c'], 1, 3).to_dict()
+            del state['opponents']
+            del state['withdrawn']
+            del state['playing']
+            state['current'] = ['a', 'b', 'c']
+            with open(path, 'w') as f:
+                json.dump(state, f)
+            t = DdzTournament.load(path)
+            self.assertEqual(t.opponents, {'a': [], 'b': [], 'c': []})
+            self.assertEqual(t.withdrawn, [])
+            self.assertEqual(t.pending, [['a', 'b', 'c']])
+            self.assertEqual(t.playing, [])
+
+
+if __name__ == '__main__':
+    unittest.main()